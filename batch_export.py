@@ -0,0 +1,148 @@
+# batch_export.py
+# Name: Hidetomi Nitta
+# Purpose: Headless (Agg) export of PDFs/PNGs from MK DiaMOND pipeline pickles, without the GUI (e.g. nightly exports)
+
+# Usage:
+# python batch_export.py results_1.pkl results_2.pkl --type pdf --groupings Strain Timepoint Drug --partition
+# python batch_export.py results.pkl --type png --gr --strains EL --out exports/
+# python batch_export.py results.pkl --combos --drugs BDQ   (all combos containing BDQ)
+# python batch_export.py results.pkl --partition --incremental   (nightly: only re-renders plots that changed)
+# python batch_export.py results.pkl --partition --compact 150 --page-report   (rasterized data, size/time per page)
+
+import matplotlib
+matplotlib.use('Agg')  # before anything imports pyplot; customtkinter is never imported
+import argparse, os, sys, traceback
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from helper import generate_plot_images, PageStats
+from result_cache import load_store
+from result_store import DrugIndex
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Export dose response (or growth rate) plots of MK DiaMOND result '
+                                                 'pickles to a PDF or PNGs without the GUI.')
+    parser.add_argument('files', nargs='+', type=Path, help='result .pkl file(s)')
+    parser.add_argument('--type', choices=['pdf', 'png'], default='pdf', help='export type (default: pdf)')
+    parser.add_argument('--groupings', nargs='+', choices=['Strain', 'Drug', 'Timepoint'],
+                        default=['Strain', 'Timepoint', 'Drug'], help='sort order of plots (default: Strain Timepoint Drug)')
+    parser.add_argument('--gr', action='store_true', help='growth rate instead of dose response')
+    parser.add_argument('--partition', action='store_true', help='one plot per replicate')
+    parser.add_argument('--batch-size', type=int, default=2, help='plots per PDF page, 2-20 (default: 2)')
+    parser.add_argument('--drugs', nargs='+', help='drugs to export (default: all)')
+    parser.add_argument('--singles', action='store_true', help='all 1-way drugs (with --combos: all drugs)')
+    parser.add_argument('--combos', action='store_true',
+                        help='all 2-way drugs (with --singles: all drugs, with --drugs: all combos containing them)')
+    parser.add_argument('--strains', nargs='+', help='strains to export (default: all)')
+    parser.add_argument('--timepoints', nargs='+', help='timepoints to export (default: all)')
+    parser.add_argument('--out', type=Path,
+                        help='directory in which a new folder is created for every export (default: next to each .pkl '
+                             'file, in <name>_plots)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only re-render plots whose inputs changed since the last export into the same directory, '
+                             '<name>_plots or --out/<name> for every .pkl file (stable file names, resumes interrupted '
+                             'exports)')
+    parser.add_argument('--compact', type=int, nargs='?', const=150, metavar='DPI',
+                        help='rasterize curves and scatter markers of PDF pages at DPI (default: 150), text and axes '
+                             'stay vectors')
+    parser.add_argument('--page-report', action='store_true', help='print the render time and size of every PDF page')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='do not write a <name>.pkl.cache directory next to each .pkl file (a current cache is '
+                             'still used)')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1,
+                        help='number of .pkl files exported in parallel (default: number of cores)')
+
+    args = parser.parse_args(argv)
+
+    if len(set(args.groupings)) != len(args.groupings):
+        parser.error('--groupings must not contain duplicates')
+
+    if not 2 <= args.batch_size <= 20:
+        parser.error('--batch-size must be between 2 and 20')
+
+    if args.compact is not None and not 50 <= args.compact <= 1200:
+        parser.error('--compact DPI must be between 50 and 1200')
+
+    # Same restriction as PDFToplevel: superimposed plots need multiple strains OR multiple timepoints (not both)
+    if not args.partition and args.strains and args.timepoints and len(args.strains) > 1 and len(args.timepoints) > 1:
+        parser.error('multiple --strains AND --timepoints can only be exported with --partition')
+
+    return args
+
+def export_file(file_path: Path, args: argparse.Namespace, workers: int = 1) -> str:
+    """Exports one result pickle with the options of args (see parse_args()) and returns a summary line. Selections
+    follow PlotGUI.get_user_inputs and PlotGUI.save_selections."""
+
+    store = load_store(file_path, write=not args.no_cache)  # memory-mapped from the sidecar cache after the first run
+    df = store.df
+
+    df_drugs = list(df['Drug'].unique())
+    drug_index = DrugIndex(df_drugs)
+
+    if args.singles and args.combos:
+        drugs = df_drugs
+    elif args.singles:
+        drugs = drug_index.singles
+    elif args.combos:
+        drugs = drug_index.combos_containing(args.drugs) if args.drugs else drug_index.combos
+    else:
+        drugs = [d for d in df_drugs if d in args.drugs] if args.drugs else df_drugs
+
+    strains = [s for s in df['Strain'].unique() if s in args.strains] if args.strains else list(df['Strain'].unique())
+    timepoints = [t for t in df['Timepoint'].unique() if t in args.timepoints] if args.timepoints else \
+        list(df['Timepoint'].unique())
+
+    if not all([drugs, strains, timepoints]):
+        return f'{file_path}: nothing to export for the selected drugs, strains, and timepoints'
+
+    if not args.partition and len(strains) > 1 and len(timepoints) > 1:
+        return f'{file_path}: has multiple strains AND timepoints, select one with --strains/--timepoints or use --partition'
+
+    # Incremental exports need a stable directory per file (files exported in parallel must not share a manifest)
+    if args.out:
+        save_path = args.out / file_path.stem if args.incremental else args.out
+    else:
+        save_path = file_path.parent / f'{file_path.stem}_plots'
+    save_path.mkdir(parents=True, exist_ok=True)
+
+    rows = store.rows(drugs, strains, timepoints).sort_values(args.groupings)
+    page_stats = PageStats()
+    generate_plot_images(rows, drugs=drugs, strains=strains, timepoints=timepoints, save_path=save_path,
+                         save_type=args.type, batch_size=args.batch_size, gr=args.gr, partition=args.partition,
+                         store=store, workers=workers, incremental=args.incremental, raster_dpi=args.compact,
+                         page_stats=page_stats)
+
+    summary = f'{file_path}: {len(rows)} rows exported to {page_stats.file_name or save_path}'
+
+    if args.type == 'pdf':
+        summary += f' ({page_stats.summary()})'
+
+        if args.page_report and page_stats.pages:
+            summary += '\n' + page_stats.table()
+
+    return summary
+
+def main(argv=None) -> int:
+    """Exports every file, several at a time. Cores that are not used by a file are used to render its pages/images."""
+
+    args = parse_args(argv)
+    jobs = max(1, min(args.jobs, len(args.files)))
+    workers = max(1, (os.cpu_count() or 1) // jobs)  # worker processes per file
+    failed = 0
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(export_file, file_path, args, workers): file_path for file_path in args.files}
+
+        for future, file_path in futures.items():
+            try:
+                print(future.result())
+            except Exception:
+                print(f'{file_path}: export failed', file=sys.stderr)
+                traceback.print_exc()
+                failed += 1
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
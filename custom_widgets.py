@@ -3,54 +3,343 @@
 # Purpose: Custom widgets for use in PlotGUI class
 
 import customtkinter as ctk
+import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from mplcursors import cursor
+from matplotlib.text import Annotation
+from scipy.spatial import KDTree
 
 # make sure to destroy textbox once created...
 
-class PlotFrame(ctk.CTkFrame):
-    """Frame that contains the id/location for the respective data that is displayed on subplots (or a plot in the case
-    of a single drug selection). Also serves as master for MSToplevel object through which receives replicates selected
-    for removal (manual selection)."""
+class PrerenderedCanvas(FigureCanvasTkAgg):
+    """FigureCanvasTkAgg that pastes the RGBA buffer of a renderer drawn off the Tk thread (rendering.FrameRenderer)
+    instead of drawing the figure itself. A normal draw is done once the figure changes (e.g. annotations, manual
+    selection highlights) or the canvas size no longer matches the prerendered buffer. The buffer is copied into the
+    canvas' own renderer, so prerendered renderers (e.g. in rendering.RasterCache) are never drawn on.
+
+    prepare is called before a normal draw (e.g. to swap in artists that were skipped while only the buffer was shown).
+    """
+
+    def __init__(self, figure, master, renderer=None, prepare=None):
+        super().__init__(figure, master=master)
+        self.prerendered = renderer
+        self.prepare = prepare
+
+    def set_prerendered(self, renderer):
+        """Sets a renderer that was drawn from a figure identical to the current state of self.figure. Any change to
+        the figure after this call invalidates it."""
+
+        self.prerendered = renderer
+        self.figure.stale = False
+
+        return
+
+    def draw(self):
+        renderer = self.prerendered
+
+        if (renderer is not None and not self.figure.stale and
+                (renderer.width, renderer.height) == self.get_width_height(physical=True)):
+            own = self.get_renderer()  # same size and dpi, re-used between draws
+            np.asarray(own.buffer_rgba())[:] = np.asarray(renderer.buffer_rgba())
+            self.blit()
+            return
+
+        if self.prepare:
+            self.prepare()
+
+        self.prerendered = None
+        super().draw()
+
+        return
+
+    def resize(self, event):
+        """Configure events re-set the figure size (which marks the figure as stale) even if the size is unchanged.
+        Keep the prerendered buffer in that case."""
+
+        stale = self.figure.stale
+        size = self.get_width_height(physical=True)
+        super().resize(event)
+
+        if self.get_width_height(physical=True) == size:
+            self.figure.stale = stale
+
+        return
+
+
+class PointIndex:
+    """Spatial index of a display frame: one KD-tree per axes over every scatter point and fitted-curve sample in
+    display coordinates, built once after the artists of the display frame are swapped in (see PlotFrame.load_artists).
+    Hover and click lookups are O(log n) queries that also return the replicate that a point belongs to.
+
+    Display coordinates depend on the canvas size, so the index has to be rebuilt on resize."""
+
+    def __init__(self, fig, subplots: list):
+        self.trees = dict()  # axs -> (KDTree, data points, replicates)
+
+        for axs, elements in zip(fig.get_axes(), subplots):
+            if not elements:
+                continue
+
+            points, replicates = list(), list()
+
+            for (x, y, _), replicate in zip(elements['lines'] + elements['scatters'],
+                                            elements['line_replicates'] + elements['scatter_replicates']):
+                xy = np.column_stack([x, y])
+                xy = xy[np.isfinite(xy).all(axis=1)]
+                points.append(xy)
+                replicates += [replicate] * len(xy)
+
+            if replicates:
+                points = np.concatenate(points)
+                self.trees[axs] = (KDTree(axs.transData.transform(points)), points, replicates)
+
+    def query(self, axs, x: float, y: float, tolerance: float) -> tuple | None:
+        """Closest point of axs within tolerance pixels of display coordinates (x, y) as
+        ((x, y) in data coordinates, (replicate number within the subplot, row label)). None if there is none."""
+
+        if axs not in self.trees:
+            return None
+
+        tree, points, replicates = self.trees[axs]
+        distance, i = tree.query((x, y), distance_upper_bound=tolerance)
+
+        if not np.isfinite(distance):
+            return None
+
+        return tuple(points[i]), replicates[i]
+
+
+class BlitHover:
+    """Hover readout for the data points of one axes at a time, looked up in the PointIndex of the display frame. The
+    static background of the canvas is cached and only the (animated) annotation is drawn and blitted on motion
+    events, so hovering never causes a full redraw.
+
+    The background is captured lazily and has to be invalidated whenever the canvas content changes (full draws are
+    handled through draw_event, pasted buffers through self.invalidate)."""
+
+    tolerance = 10  # pixels
+
+    def __init__(self, fig, canvas):
+        self.fig = fig
+        self.canvas = canvas
+        self.axs = None
+        self.point_index = None  # PointIndex of the display frame that is shown
+        self.background = None
+        self.hit = None  # annotated point, as returned by PointIndex.query
+
+        self.annotation = Annotation('', xy=(0, 0), xycoords='figure pixels', xytext=(10, 10),
+                                     textcoords='offset points', fontsize=9, animated=True,
+                                     bbox=dict(fc='white', alpha=0.8, edgecolor='none'))
+        self.fig.add_artist(self.annotation)
+
+    def enter(self, axs):
+        self.axs = axs
+
+        return
+
+    def leave(self):
+        self.hide()
+        self.axs = None
+
+        return
+
+    def motion(self, event):
+        """Annotates the closest point within self.tolerance pixels of the mouse (or hides the annotation)."""
+
+        if self.axs is None or event.inaxes is not self.axs or self.point_index is None:
+            return
+
+        hit = self.point_index.query(self.axs, event.x, event.y, self.tolerance)
 
-    def __init__(self, master, fig, subplot_rep_locs):
+        if hit is None:
+            self.hide()
+        elif hit != self.hit:
+            self.show(hit)
+
+        return
+
+    def show(self, hit):
+        if self.background is None:
+            self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+
+        (x, y), (_, row_idx) = hit
+        stale = self.fig.stale  # the animated annotation is not part of full draws
+
+        self.annotation.xy = self.axs.transData.transform((x, y))
+        self.annotation.set_text(f"{x:.2f}, {y:.2f}\nrow {row_idx}")
+        self.fig.stale = stale
+
+        self.canvas.restore_region(self.background)
+        self.fig.draw_artist(self.annotation)
+        self.canvas.blit(self.fig.bbox)
+        self.hit = hit
+
+        return
+
+    def hide(self):
+        if self.hit is not None and self.background is not None:
+            self.canvas.restore_region(self.background)
+            self.canvas.blit(self.fig.bbox)
+
+        self.hit = None
+
+        return
+
+    def invalidate(self, event=None):
+        """Drops the cached background (the canvas content changed)."""
+
+        self.background = None
+        self.hit = None
+
+        return
+
+
+class PlotFrame(ctk.CTkFrame):
+    """Pooled frame (one per grid layout) that shows one display frame at a time. self.load_frame pastes the
+    prerendered buffer of a display frame, instead of a new figure and canvas being built per frame. The artist data of
+    the display frame is only swapped into the existing axes (self.load_artists) once it is needed, i.e. on hover,
+    double-click, or a normal draw. Contains the id/location for the respective data that is displayed on subplots.
+    Also serves as master for MSToplevel object through which receives replicates selected for removal (manual
+    selection), which are kept per display frame so that they survive navigation."""
+
+    def __init__(self, master, fig, populate):
         super().__init__(master, height=650)
         self.fig = fig
         self.num_axes = len(self.fig.get_axes())
+        self.populate = populate  # callable(fig, content) that swaps the content of a display frame into fig
 
         self.grid(row=0, column=0, padx=5, pady=5, sticky='nsew')
         self.grid_rowconfigure(0, weight=1)
         self.grid_columnconfigure(0, weight=1)
         self.lower() # control visibility
 
-        self.canvas = FigureCanvasTkAgg(self.fig, master=self)
+        self.content = None  # content of the display frame that is currently shown
+        self.loaded = True  # whether self.content is swapped into the figure
+
+        self.canvas = PrerenderedCanvas(self.fig, master=self, prepare=self.load_artists)
         self.canvas.get_tk_widget().grid(row=0, column=0, sticky='nsew')
 
         # Event-related connections
         self.mst_cid = None
         self.cur_enter_cid = None
         self.cur_leave_cid = None
-        self.active_cursor = None
+        self.cur_motion_cid = None
+        self.hover = BlitHover(self.fig, self.canvas)
+        self.canvas.mpl_connect('draw_event', self.hover.invalidate)
+        self.canvas.mpl_connect('resize_event', lambda event: self.index_points())
 
         # Manual selection variables
-        self.subplot_rep_locs = subplot_rep_locs
-        self.mapped_selections = dict()
+        self.i_frame = None  # display frame that is currently loaded
+        self.subplot_rep_locs = dict()
+        self.mapped_selections = dict()  # axs -> selections, for the display frame that is currently loaded
+        self.subplot_keys = dict()  # axs -> SelectionHistory key, for the display frame that is currently loaded
+        self.history = None  # SelectionHistory of the file, set by PlotGUI
+        self.refit = None  # callable(keys) -> {key: (x, y, label)} of re-fitted curves, set by PlotGUI
+        self.refit_lines = dict()  # axs -> Line2D of the re-fitted curve
         self.mst = list() # store MSToplevel
-        self.ms_condition = any(self.subplot_rep_locs.values()) # whether to allow MS on a frame
+        self.ms_allowed = True  # set by PlotGUI (manual selection is only used for singles)
+        self.ms_condition = False # whether to allow MS on a frame
+
+        self.canvas.draw()
+
+    def load_frame(self, i_frame, content, renderer=None):
+        """Shows display frame i_frame (see PlotGUI.populate_frame for the format of content) by pasting the renderer
+        that was drawn offscreen for it. The artists are swapped in right away only if there is no renderer or manual
+        selection highlights have to be restored. Event listeners should be toggled off beforehand."""
+
+        for mst in self.mst:  # selections of an open MSToplevel belong to the outgoing display frame
+            mst.destroy()
+        self.mst.clear()
+
+        self.remove_refits()  # they belong to the outgoing display frame
+
+        self.i_frame = i_frame
+        self.content = content
+        self.loaded = False
+
+        axes = self.fig.get_axes()
+        self.subplot_rep_locs = dict(zip(axes, content['rep_locs']))
+        self.ms_condition = self.ms_allowed and any(content['rep_locs']) # whether to allow MS on a frame
+
+        self.subplot_keys = {axs: self.history.key(elements['title'], rep_locs)
+                             for axs, elements, rep_locs in zip(axes, content['subplots'], content['rep_locs'])
+                             if elements and rep_locs} if self.history else dict()
+        self.mapped_selections = {axs: self.history.get(key) for axs, key in self.subplot_keys.items()
+                                  if self.history.get(key) is not None}
+        highlights = [axs for axs, selections in self.mapped_selections.items() if any(selections)]
+        curves = self.refit_curves(highlights)
+
+        self.canvas.set_prerendered(renderer)
+        self.hover.invalidate()
+        self.hover.point_index = None
+
+        if renderer is None or highlights:
+            self.load_artists()
+
+            for axs in highlights:
+                axs.set_facecolor('#FFB3B3')
+
+            self.draw_refits(highlights, curves)
 
         self.canvas.draw()
-        plt.close(self.fig)
+
+        return
+
+    def load_artists(self):
+        """Swaps the artist data of the display frame that is shown into the figure (once per load_frame)."""
+
+        if self.loaded or self.content is None:
+            return
+
+        self.loaded = True
+        self.populate(self.fig, self.content)
+        self.index_points()
+
+        # The figure matches the pasted buffer again
+        self.canvas.set_prerendered(self.canvas.prerendered)
+
+        return
+
+    def index_points(self):
+        """(Re-)builds the PointIndex used by hover and double-click for the display frame that is loaded."""
+
+        if self.loaded and self.content is not None:
+            self.hover.point_index = PointIndex(self.fig, self.content['subplots'])
+
+        return
+
+    def reset(self):
+        """Forgets every display frame and manual selection (e.g. when plots are cleared) while keeping the figure and
+        canvas for re-use."""
+
+        self.toggle_event_listeners(state=False)
+
+        for mst in self.mst:
+            mst.destroy()
+        self.mst.clear()
+
+        self.i_frame = None
+        self.content = None
+        self.loaded = True
+        self.hover.point_index = None
+        self.subplot_rep_locs = dict()
+        self.remove_refits()
+        self.mapped_selections.clear()
+        self.subplot_keys = dict()
+        self.ms_condition = False
+        self.lower()
+
+        return
 
     def __del__(self):
         print (f'PlotFrame was deleted')
 
     def toggle_event_listeners(self, state: bool):
-        """Allows for the toggling of mplcursors obj/connections and connection responsible for manual selection feature.
-         Also removes any lingering references for prophylactic garbage collection."""
+        """Allows for the toggling of the hover connections (self.hover) and connection responsible for manual selection
+        feature. Also removes any lingering references for prophylactic garbage collection."""
 
         if state:
-            if not all([self.mst_cid, self.cur_enter_cid, self.cur_leave_cid]):
+            if not all([self.mst_cid, self.cur_enter_cid, self.cur_leave_cid, self.cur_motion_cid]):
                 if self.ms_condition:
                     self.mst_cid = self.fig.canvas.mpl_connect('button_press_event', self.on_click)
                 else:
@@ -60,56 +349,40 @@ class PlotFrame(ctk.CTkFrame):
                                                                  lambda event: self.toggle_cursor(event, state=True))
                 self.cur_leave_cid = self.fig.canvas.mpl_connect('axes_leave_event',
                                                                  lambda event: self.toggle_cursor(event, state=False))
+                self.cur_motion_cid = self.fig.canvas.mpl_connect('motion_notify_event', self.hover.motion)
 
         else:
-            if self.mst_cid and self.cur_enter_cid and self.cur_leave_cid:
+            if self.mst_cid and self.cur_enter_cid and self.cur_leave_cid and self.cur_motion_cid:
                 if self.ms_condition:
                     self.fig.canvas.mpl_disconnect(self.mst_cid)
 
                 self.mst_cid = None
-
-                if self.active_cursor:
-                    self.active_cursor.remove()
-                    self.active_cursor = None
+                self.hover.leave()
 
                 self.fig.canvas.mpl_disconnect(self.cur_enter_cid)
                 self.fig.canvas.mpl_disconnect(self.cur_leave_cid)
+                self.fig.canvas.mpl_disconnect(self.cur_motion_cid)
                 self.cur_enter_cid = None
                 self.cur_leave_cid = None
+                self.cur_motion_cid = None
 
         return
 
     def toggle_cursor(self, event, state:bool):
-        """Handles cursor creation/destruction logic using axes_enter_event (state=True) and axes_leave_event
-         (state=False), respectively. Artists that cursor uses is dependent on the number of plots visible per frame
-         for smoother performance (line2D at the very least). """
+        """Points the blitted hover layer (self.hover) at the axs obj that is entered (state=True, axes_enter_event) or
+        clears it when the axs obj is left (state=False, axes_leave_event). Works for every number of plots per frame
+        since motion events only blit the annotation."""
 
         event_axs = event.inaxes
 
         if state: # for entering axs obj
             if event_axs:
-                if self.active_cursor: # vestigial cursor
-                    self.active_cursor.remove()
-                    self.active_cursor = None
-
-                if not self.active_cursor:
-                    # Dynamic cursor artists dependent on number of subplots per frame for best performance
-                    artists = (list(event_axs.lines) if self.num_axes <=9 else list()) + (list(event_axs.collections)
-                                                                              if self.num_axes <=4 else list())
-                    if artists:
-                        c = cursor(artists, hover=None)
-                        self.active_cursor = c
-
-                        @c.connect("add") # Adjust mplcursors annotation style
-                        def on_add(sel):
-                            sel.annotation.set_text(f"{sel.target[0]:.2f}, {sel.target[1]:.2f}")
-                            sel.annotation.get_bbox_patch().set(fc="white", alpha=0.8, edgecolor="none")
+                self.load_artists()
+                self.hover.enter(event_axs)
 
         else: # for leaving axs obj
             if event_axs: # refers to axs obj that is being left
-                if self.active_cursor:
-                    self.active_cursor.remove()
-                    self.active_cursor = None
+                self.hover.leave()
 
         return
 
@@ -118,10 +391,15 @@ class PlotFrame(ctk.CTkFrame):
 
         event_axs = event.inaxes
 
-        if event_axs and event.dblclick:
+        if event_axs and event.dblclick and self.subplot_rep_locs.get(event_axs):
+            self.load_artists()
             title = event_axs.get_title()
             rep_locs = self.subplot_rep_locs[event_axs]
 
+            # Replicate of the point that was double-clicked on (if any)
+            hit = self.hover.point_index.query(event_axs, event.x, event.y, self.hover.tolerance)
+            picked = hit[1][0] if hit else None
+
             if event_axs in self.mapped_selections.keys(): # if subplot has been clicked on before
                 prior_selections = self.mapped_selections[event_axs]
             elif not all(rep_locs):
@@ -131,7 +409,7 @@ class PlotFrame(ctk.CTkFrame):
 
             if not any(isinstance(child, ctk.CTkToplevel) for child in self.winfo_children()):
                 mst = MSToplevel(master=self, title=title, canvas=self.canvas, event=event, rep_locs=rep_locs,
-                           on_close_callback=self.receive_on_close, prior_selections=prior_selections)
+                           on_close_callback=self.receive_on_close, prior_selections=prior_selections, picked=picked)
                 self.mst.append(mst)
 
             self.canvas.draw_idle()
@@ -139,33 +417,81 @@ class PlotFrame(ctk.CTkFrame):
         return
 
     def receive_on_close(self, fromToplevel):
-        """Method to receive replicates that were selected for removal from MSToplevel widget."""
+        """Method to receive replicates that were selected for removal from MSToplevel widget (recorded in
+        self.history)."""
 
         axs, selections = fromToplevel
         self.mapped_selections.update({axs: selections})
-        self.filter_replicates_for_removal()
+
+        if self.history.set(self.subplot_keys[axs], selections):
+            print(f'Reps for removal: {self.history.reps_to_remove()}')
+
+            self.draw_refits([axs], self.refit_curves([axs]))
+            self.canvas.draw_idle()
 
         return
 
-    def filter_replicates_for_removal(self):
-        """Contains a set of the integer label (using .loc) of selected replicates or string of single in which >1
-        replicate(s) was selected for removal."""
+    def refresh_selections(self, key):
+        """Re-reads the selections of the subplot with key from self.history (after an undo/redo) and updates its
+        highlight, if that subplot is on the display frame that is loaded."""
 
-        self.reps_to_remove = set()
+        axes = [axs for axs, subplot_key in self.subplot_keys.items() if subplot_key == key]
 
-        for axs, selections in self.mapped_selections.items():
-            rep_locs = self.subplot_rep_locs[axs]
-            title = axs.get_title()
+        if not axes:
+            return
 
-            if selections.count(True) >= 2:
-                self.reps_to_remove.add(title)
+        axs = axes[0]
+        selections = self.history.get(key)
+        self.load_artists()
 
-            else:
-                for r, s in zip(rep_locs, selections):
-                    if s and r != None:
-                        self.reps_to_remove.add(r)
+        if selections is None:
+            self.mapped_selections.pop(axs, None)
+        else:
+            self.mapped_selections[axs] = selections
 
-        print(f'Reps for removal: {self.reps_to_remove}')
+        axs.set_facecolor('#FFB3B3' if selections and any(selections) else '#d8dee9')
+        self.draw_refits([axs], self.refit_curves([axs]))
+        self.canvas.draw_idle()
+
+        return
+
+    def refit_curves(self, axes) -> dict:
+        """axs -> (x, y, label) of the re-fitted curve of each of axes that has one (see PlotGUI.refit_curves). Curves
+        of all axes are fitted in one batch."""
+
+        keys = {axs: self.subplot_keys[axs] for axs in axes if axs in self.subplot_keys}
+
+        if self.refit is None or not keys:
+            return dict()
+
+        curves = self.refit(list(keys.values()))
+
+        return {axs: curves[key] for axs, key in keys.items() if key in curves}
+
+    def draw_refits(self, axes, curves: dict):
+        """Replaces the re-fitted curves of axes with curves (from self.refit_curves). Artists need to be loaded."""
+
+        for axs in axes:
+            line = self.refit_lines.pop(axs, None)
+
+            if line is not None:
+                line.remove()
+
+            if axs in curves:
+                x, y, label = curves[axs]
+                self.refit_lines[axs], = axs.plot(x, y, color='black', ls='-', lw=1.5, alpha=0.8, label=label)
+
+            if line is not None or axs in curves:
+                legend = axs.get_legend()
+                fontsize = legend.get_texts()[0].get_fontsize() if legend and legend.get_texts() else None
+                axs.legend(frameon=False, fontsize=fontsize)
+
+        return
+
+    def remove_refits(self):
+        """Removes every re-fitted curve (pooled axes are re-used by other display frames)."""
+
+        self.draw_refits(list(self.refit_lines), dict())
 
         return
 
@@ -174,9 +500,9 @@ class PlotFrame(ctk.CTkFrame):
         collection from occurring."""
 
         # Hover feature
-        if self.active_cursor:
-            self.active_cursor.remove()
-            self.active_cursor = None
+        if self.hover:
+            self.hover.leave()
+            self.hover = None
 
             # Double-click event
         if self.mst_cid:
@@ -209,6 +535,8 @@ class PlotFrame(ctk.CTkFrame):
         # References holding axs references
         self.subplot_rep_locs.clear()
         self.mapped_selections.clear()
+        self.subplot_keys.clear()
+        self.refit_lines.clear()
 
         super().destroy()
 
@@ -216,8 +544,7 @@ class PlotFrame(ctk.CTkFrame):
 
 
 class ParameterCheckbox(ctk.CTkCheckBox):
-    """Checkbox object that is generated in drugs, strains, and timepoint scrollable frames OR MSToplevel.
-    Stored in self.checkboxes."""
+    """Checkbox object for each replicate in MSToplevel. Stored in MSToplevel.checkboxes."""
 
     def __init__(self, master, row, text, **kwargs):
         self.var = ctk.BooleanVar()
@@ -232,11 +559,162 @@ class ParameterCheckbox(ctk.CTkCheckBox):
         return
 
 
+class CheckList(ctk.CTkFrame):
+    """Virtualized list of checkboxes for drugs, strains, or timepoints. Only a small pool of row checkboxes exists
+    (as many as fit in the list's height), and they are recycled over the rows in view while scrolling. Whether an item
+    is checked lives in self.selection, a bool np.ndarray aligned with self.items, so new files only replace arrays.
+
+    Typing in the filter entry narrows the rows to items that contain the text (case-insensitive). The first fixed
+    items (e.g. 1-way and 2-way) are never filtered out."""
+
+    def __init__(self, master, height: int, width: int = 200, fixed: int = 0, row_height: int = 30, **kwargs):
+        super().__init__(master, width=width, height=height, **kwargs)
+        self.grid_propagate(False)
+        self.grid_columnconfigure(0, weight=1)
+
+        self.fixed = fixed
+        self.items = list()
+        self.names = np.empty(0, dtype=str)  # lower case items for the filter
+        self.selection = np.zeros(0, dtype=bool)
+        self.visible = np.arange(0)  # item indices that pass the filter, in order
+        self.query = ''
+        self.top = 0  # position in self.visible of the first row in view
+
+        self.filter_entry = ctk.CTkEntry(self, placeholder_text='Filter', height=24)
+        self.filter_entry.grid(row=0, column=0, columnspan=2, padx=8, pady=(8, 2), sticky='ew')
+        self.filter_entry.bind('<KeyRelease>', lambda event: self.apply_filter())
+
+        # Pool of row checkboxes (as many as fit below the filter entry)
+        n_rows = max(1, (height - 34) // row_height)
+        self.rows = list()
+
+        self.scrollbar = ctk.CTkScrollbar(self, orientation='vertical', command=self.scrollbar_command)
+        self.scrollbar.grid(row=1, column=1, rowspan=n_rows, padx=(0, 4), sticky='ns')
+
+        for i in range(n_rows):
+            var = ctk.BooleanVar()
+            row = ctk.CTkCheckBox(self, text='', variable=var, text_color='#455669', height=row_height - 6,
+                                  command=lambda i=i: self.toggle(i))
+            row.grid(row=i + 1, column=0, padx=8, pady=3, sticky='w')
+            self.rows.append((row, var))
+
+        for widget in [self] + [row for row, _ in self.rows]:
+            widget.bind('<MouseWheel>', self.on_mousewheel)
+            widget.bind('<Button-4>', self.on_mousewheel)  # X11
+            widget.bind('<Button-5>', self.on_mousewheel)
+
+        self.render()
+
+    def set_items(self, items):
+        """Replaces the items (all unchecked) and clears the filter."""
+
+        self.items = [str(item) for item in items]
+        self.names = np.char.lower(np.array(self.items, dtype=str))
+        self.selection = np.zeros(len(self.items), dtype=bool)
+        self.visible = np.arange(len(self.items))
+        self.query = ''
+        self.top = 0
+
+        self.filter_entry.delete(0, ctk.END)
+        self.render()
+
+        return
+
+    def selected(self) -> np.ndarray:
+        """Indices of the checked items (after the fixed items, i.e. relative to self.items[self.fixed:])."""
+
+        return np.flatnonzero(self.selection[self.fixed:])
+
+    def clear(self):
+        """Unchecks every item."""
+
+        self.selection[:] = False
+        self.render()
+
+        return
+
+    def apply_filter(self):
+        """Narrows self.visible to items that contain the filter text. When the text only grew (typing), only the
+        items that passed the previous filter are searched."""
+
+        query = self.filter_entry.get().strip().lower()
+
+        if query == self.query:
+            return
+
+        if self.query and self.query in query:
+            candidates = self.visible[self.visible >= self.fixed]
+        else:
+            candidates = np.arange(self.fixed, len(self.items))
+
+        if query:
+            candidates = candidates[np.char.find(self.names[candidates], query) >= 0]
+
+        self.visible = np.concatenate([np.arange(min(self.fixed, len(self.items))), candidates]).astype(int)
+        self.query = query
+        self.top = 0
+        self.render()
+
+        return
+
+    def render(self):
+        """Shows the items self.visible[self.top:] on the pooled rows and updates the scrollbar."""
+
+        for i, (row, var) in enumerate(self.rows):
+            position = self.top + i
+
+            if position < len(self.visible):
+                index = self.visible[position]
+                row.configure(text=self.items[index])
+                var.set(bool(self.selection[index]))
+                row.grid()
+            else:
+                row.grid_remove()
+
+        if len(self.visible) > len(self.rows):
+            self.scrollbar.set(self.top / len(self.visible), (self.top + len(self.rows)) / len(self.visible))
+        else:
+            self.scrollbar.set(0, 1)
+
+        return
+
+    def scroll_to(self, top: int):
+        self.top = max(0, min(top, len(self.visible) - len(self.rows)))
+        self.render()
+
+        return
+
+    def toggle(self, i: int):
+        """Checkbox command of pooled row i."""
+
+        _, var = self.rows[i]
+        self.selection[self.visible[self.top + i]] = var.get()
+
+        return
+
+    def on_mousewheel(self, event):
+        step = -1 if getattr(event, 'num', None) == 4 or getattr(event, 'delta', 0) > 0 else 1
+        self.scroll_to(self.top + step)
+
+        return
+
+    def scrollbar_command(self, *args):
+        """Scrollbar callback: ('moveto', fraction) or ('scroll', number, 'units'|'pages')."""
+
+        if args[0] == 'moveto':
+            self.scroll_to(round(float(args[1]) * len(self.visible)))
+        elif args[0] == 'scroll':
+            step = int(args[1]) * (len(self.rows) if args[2] == 'pages' else 1)
+            self.scroll_to(self.top + step)
+
+        return
+
+
 class MSToplevel(ctk.CTkToplevel):
     """Toplevel window that appears upon double-clicking a subplot on the current frame. Allows selection of replicates
     in order to ultimately filter data for removal (manual selection)."""
 
-    def __init__(self, master, title, canvas, event, rep_locs, on_close_callback, prior_selections):
+    def __init__(self, master, title, canvas, event, rep_locs, on_close_callback, prior_selections, picked=None):
         super().__init__(master)
         self.title(title)
         self.canvas = canvas
@@ -245,6 +723,7 @@ class MSToplevel(ctk.CTkToplevel):
         self.rep_locs = rep_locs
         self.on_close_callback = on_close_callback
         self.prior_selections = prior_selections
+        self.picked = picked  # replicate number of the point that was double-clicked on
         self.checkboxes = list()
 
         self.geometry(f"+{self.event.guiEvent.x_root}+{self.event.guiEvent.y_root}")
@@ -265,7 +744,8 @@ class MSToplevel(ctk.CTkToplevel):
 
             elif num_of_reps <=3:
                 color = ['red', 'blue', 'green'][i]
-                checkbox = ParameterCheckbox(master=self, row=i, text=f'R{i+1}', fg_color=color)
+                text = f'R{i+1} \u2190' if i == self.picked else f'R{i+1}'  # marks the replicate that was clicked on
+                checkbox = ParameterCheckbox(master=self, row=i, text=text, fg_color=color)
                 checkbox.grid(sticky='e')
 
                 if self.prior_selections:
@@ -335,7 +815,7 @@ class PDFToplevel(ctk.CTkToplevel):
         self.title(title)
         self.callback = callback
         self.can_superimpose = restrictions
-        self.grid_rowconfigure(index=(0,1,2,3,4,5,6,7), weight=1)
+        self.grid_rowconfigure(index=(0,1,2,3,4,5,6,7,8), weight=1)
         self.grid_columnconfigure(index=(0,1), weight=1)
 
         # Choose grouping of strain, drug, and timepoint
@@ -376,9 +856,20 @@ class PDFToplevel(ctk.CTkToplevel):
                                                   text_color='#455669')
         self.partition_checkbox.grid(row=5, column=1, padx=15, pady=5)
 
+        # Compact: curves and scatters are rasterized at the selected dpi (smaller PDF files)
+        self.compact_var = ctk.BooleanVar()
+        self.compact_checkbox = ctk.CTkCheckBox(master=self, variable=self.compact_var, text='Compact',
+                                                text_color='#455669')
+        self.compact_checkbox.grid(row=6, column=0, padx=15, pady=5)
+
+        self.dpi_var = ctk.StringVar(value='150 dpi')
+        self.dpi_menu = ctk.CTkOptionMenu(master=self, values=['100 dpi', '150 dpi', '200 dpi', '300 dpi'],
+                                          variable=self.dpi_var, width=90)
+        self.dpi_menu.grid(row=6, column=1, padx=15, pady=5)
+
         self.slider_var = ctk.IntVar(value=2)
         self.batch_slider = ctk.CTkSlider(master=self, from_=2, to=20, number_of_steps=18, variable=self.slider_var)
-        self.batch_slider.grid(row=6, column=0, columnspan=2, padx=10, pady=20)
+        self.batch_slider.grid(row=7, column=0, columnspan=2, padx=10, pady=20)
 
         self.update_idletasks()
         slider_x = (self.batch_slider.winfo_x())
@@ -389,7 +880,7 @@ class PDFToplevel(ctk.CTkToplevel):
 
         # Generate PDF
         self.generate_button = ctk.CTkButton(master=self, text='Generate PDF', command=self.generate_pdf, fg_color='gray', hover_color='gray30')
-        self.generate_button.grid(row=7, column=0, columnspan=2, padx=5, pady=5)
+        self.generate_button.grid(row=8, column=0, columnspan=2, padx=5, pady=5)
 
         self.bind('<FocusOut>', lambda event: self.destroy())
         self.check_grouping_selections()
@@ -399,7 +890,9 @@ class PDFToplevel(ctk.CTkToplevel):
 
         g1, g2, g3 = self.grouping_1_var.get(), self.grouping_2_var.get(), self.grouping_3_var.get()
         gr, partition, batch_size = self.gr_var.get(), self.partition_var.get(), self.slider_var.get()
-        callback_dict = {'groupings':[g1, g2, g3], 'gr': gr, 'partition': partition, 'batch_size': batch_size}
+        raster_dpi = int(self.dpi_var.get().split()[0]) if self.compact_var.get() else None
+        callback_dict = {'groupings':[g1, g2, g3], 'gr': gr, 'partition': partition, 'batch_size': batch_size,
+                         'raster_dpi': raster_dpi}
 
         self.callback(callback_dict)
         self.destroy()
@@ -455,6 +948,59 @@ class LabelToplevel(ctk.CTkToplevel):
         return
 
 
+class ExportToplevel(ctk.CTkToplevel):
+    """Toplevel widget that lists export jobs (export_jobs.ExportJob) with their progress and a cancel button each.
+    Closing the window only hides it, jobs keep running in the background."""
+
+    def __init__(self, master, title):
+        super().__init__(master)
+        self.title(title)
+        self.protocol('WM_DELETE_WINDOW', self.withdraw)
+        self.grid_columnconfigure(1, weight=1)
+        self.rows = dict()  # job id -> (job, label, progress bar, status label, cancel button)
+
+    def add_job(self, job):
+        """Adds a row for job and brings the window into view."""
+
+        row = len(self.rows)
+
+        label = ctk.CTkLabel(self, text=job.name, text_color='#455669')
+        label.grid(row=row, column=0, padx=10, pady=5, sticky='w')
+
+        progress_bar = ctk.CTkProgressBar(self, orientation='horizontal', width=200, mode='determinate')
+        progress_bar.grid(row=row, column=1, padx=5, pady=5, sticky='ew')
+        progress_bar.set(0)
+
+        status_label = ctk.CTkLabel(self, text=job.status, width=90, text_color='#627d98')
+        status_label.grid(row=row, column=2, padx=5, pady=5)
+
+        cancel_button = ctk.CTkButton(self, text='Cancel', width=20, fg_color='gray', hover_color='gray30',
+                                      command=job.cancel)
+        cancel_button.grid(row=row, column=3, padx=10, pady=5)
+
+        self.rows.update({job.id: (job, label, progress_bar, status_label, cancel_button)})
+        self.deiconify()
+        self.lift()
+
+        return
+
+    def refresh(self):
+        """Updates every row from its job. Meant to be called on the Tk thread while jobs are running."""
+
+        for job, label, progress_bar, status_label, cancel_button in self.rows.values():
+            progress = f' {job.done}/{job.total}' if job.status == 'Running' and job.total else ''
+            status = 'Cancelling' if job.cancelled.is_set() and not job.finished else job.status
+            detail = f' \u2022 {job.detail}' if job.status == 'Done' and job.detail else ''
+
+            progress_bar.set(1 if job.status == 'Done' else job.fraction)
+            status_label.configure(text=status + progress + detail)
+
+            if job.finished or job.cancelled.is_set():
+                cancel_button.configure(state=ctk.DISABLED)
+
+        return
+
+
 class SlidingBase:
     """Base class that is meant to be inherited by widgets that slide."""
 
@@ -0,0 +1,86 @@
+# export_jobs.py
+# Name: Hidetomi Nitta
+# Purpose: Queue of background exports (PDF/PNGs) for PlotGUI, run one after another on a worker thread
+
+import itertools, queue, threading, traceback
+
+
+class ExportJob:
+    """One export for ExportQueue. run is a callable(progress, cancelled) -> bool (see helper.generate_plot_images)
+    that returns False if it was cancelled. The progress and status of a job are written by the worker thread and are
+    meant to be read on the Tk thread, e.g. from a recursive self.after() call.
+
+    Status is one of 'Queued', 'Running', 'Done', 'Cancelled', or 'Failed'. run may set detail (e.g. the size of the
+    exported file), which is shown once the job is done."""
+
+    ids = itertools.count(1)
+
+    def __init__(self, name: str, run):
+        self.id = next(self.ids)
+        self.name = name
+        self.run = run
+        self.cancelled = threading.Event()
+        self.status = 'Queued'
+        self.done = 0
+        self.total = 0
+        self.error = None
+        self.detail = ''
+
+    def report(self, done: int, total: int):
+        """progress callback of run (called on the worker thread)."""
+
+        self.done, self.total = done, total
+
+        return
+
+    def cancel(self):
+        """Stops the job after its current page or image (or skips it if it has not started yet)."""
+
+        self.cancelled.set()
+
+        return
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ('Done', 'Cancelled', 'Failed')
+
+    @property
+    def fraction(self) -> float:
+        return self.done / self.total if self.total else 0.0
+
+
+class ExportQueue:
+    """Worker thread that runs submitted ExportJob objects in submission order, so that exports never block the Tk
+    thread and several exports can be queued while plots are browsed."""
+
+    def __init__(self):
+        self.jobs = queue.Queue()
+
+        self.thread = threading.Thread(target=self.run, name='ExportQueue', daemon=True)
+        self.thread.start()
+
+    def submit(self, job: ExportJob) -> ExportJob:
+        self.jobs.put(job)
+
+        return job
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+
+            if job.cancelled.is_set():
+                job.status = 'Cancelled'
+                continue
+
+            job.status = 'Running'
+
+            try:
+                completed = job.run(progress=job.report, cancelled=job.cancelled)
+
+            except Exception as e:
+                traceback.print_exc()
+                job.error = e
+                job.status = 'Failed'
+
+            else:
+                job.status = 'Done' if completed else 'Cancelled'
@@ -0,0 +1,106 @@
+# export_manifest.py
+# Name: Hidetomi Nitta
+# Purpose: Content-hash manifest of an export directory, so that re-exports only re-render plots whose inputs changed
+
+import hashlib, json, os
+import numpy as np
+from pathlib import Path
+
+
+class ExportManifest:
+    """manifest.json of an export directory. Maps every output file (name relative to the directory) to the hash of
+    the inputs it was rendered from (see plot_hash()). A file is current if it exists and its hash did not change, so
+    an interrupted export resumes with the files that were not written yet.
+
+    Updates are saved every save_every entries (and by self.save()), so that progress survives an interruption."""
+
+    version = 1
+    save_every = 50
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = dict()
+        self.unsaved = 0
+
+        if self.path.exists():
+            try:
+                with open(self.path) as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):  # unreadable manifest, everything is re-rendered
+                manifest = dict()
+
+            if manifest.get('version') == self.version:
+                self.entries = manifest.get('files', dict())
+
+    def is_current(self, name: str, digest) -> bool:
+        return self.entries.get(name) == digest and (self.path.parent / name).exists()
+
+    def update(self, name: str, digest):
+        self.entries[name] = digest
+        self.unsaved += 1
+
+        if self.unsaved >= self.save_every:
+            self.save()
+
+        return
+
+    def remove(self, name: str):
+        """Forgets name (e.g. a file that is no longer part of the export)."""
+
+        if self.entries.pop(name, None) is not None:
+            self.unsaved += 1
+
+        return
+
+    def save(self):
+        """Writes the manifest atomically (a temporary file replaces the previous manifest)."""
+
+        temp_path = self.path.with_name(self.path.name + '.tmp')
+
+        with open(temp_path, 'w') as f:
+            json.dump({'version': self.version, 'files': self.entries}, f, indent=1)
+
+        os.replace(temp_path, self.path)
+        self.unsaved = 0
+
+        return
+
+
+def plot_hash(elements_list: list, *params) -> str:
+    """sha1 of everything that a plot (or a page of plots) is rendered from: the output of helper.plot_elements() for
+    every subplot (data, fit curves, colors, and labels) and any other parameters (e.g. figure size, style version)."""
+
+    digest = hashlib.sha1()
+
+    for param in params:
+        update_hash(digest, param)
+
+    for elements in elements_list:
+        update_hash(digest, elements)
+
+    return digest.hexdigest()
+
+def update_hash(digest, value):
+    """Feeds value (nested dicts, lists, tuples, np.ndarray, or anything with a stable repr) into digest."""
+
+    if isinstance(value, np.ndarray):
+        digest.update(f'{value.dtype}{value.shape}'.encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+
+    elif isinstance(value, dict):
+        digest.update(b'{')
+        for key in sorted(value, key=str):
+            update_hash(digest, key)
+            update_hash(digest, value[key])
+        digest.update(b'}')
+
+    elif isinstance(value, (list, tuple)):
+        digest.update(b'[')
+        for item in value:
+            update_hash(digest, item)
+        digest.update(b']')
+
+    else:
+        digest.update(repr(value).encode())
+
+    return
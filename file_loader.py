@@ -0,0 +1,96 @@
+# file_loader.py
+# Name: Hidetomi Nitta
+# Purpose: Loads MK DiaMOND result pickles on a worker thread, in stages, so that PlotGUI stays responsive
+
+import queue, threading, traceback
+import pandas as pd
+import numpy as np
+from result_store import ResultStore, categorize_keys
+from result_cache import read_cache, write_cache
+
+
+class FileLoader:
+    """Loads one result pickle at a time on a worker thread. Every stage of a load is put on self.messages as
+    (load_id, stage, payload) as soon as it is done and is meant to be collected on the Tk thread with self.poll(), e.g.
+    from a recursive self.after() call:
+
+    'keys': (df, {'Drug': np.ndarray, 'Strain': ..., 'Timepoint': ...}, key_dtypes) unique keys in DataFrame order
+            (checkboxes), the key columns of df are categoricals and key_dtypes are their dtypes in the pickle (None if
+            df came from the cache), see result_store.categorize_keys()
+    'store': ResultStore of df (fit parameters and packed arrays, needed for plots and exports)
+    'error': the exception that stopped the load
+
+    A pickle that was loaded before is opened from its sidecar cache (see result_cache.py), both stages are then sent at
+    once and df only holds the key columns. Otherwise the cache is written after the 'store' stage.
+
+    Starting a new load (or self.cancel()) supersedes the previous one: its remaining stages are skipped and messages
+    that were already sent carry an old load_id."""
+
+    key_columns = ResultStore.key_columns
+
+    def __init__(self):
+        self.messages = queue.Queue()
+        self.load_id = 0
+
+    def load(self, file_path) -> int:
+        """Starts loading file_path and returns the id of the load."""
+
+        self.load_id += 1
+
+        thread = threading.Thread(target=self.run, args=(self.load_id, file_path), name='FileLoader', daemon=True)
+        thread.start()
+
+        return self.load_id
+
+    def cancel(self):
+        """Supersedes the current load (a pickle that is being read is still read to the end)."""
+
+        self.load_id += 1
+
+        return
+
+    def poll(self) -> list:
+        """Messages since the last call (non-blocking)."""
+
+        messages = list()
+
+        while True:
+            try:
+                messages.append(self.messages.get_nowait())
+            except queue.Empty:
+                break
+
+        return messages
+
+    def run(self, load_id, file_path):
+        try:
+            store = read_cache(file_path)
+
+            if store is not None:
+                keys = {column: pd.unique(store.keys[column]) for column in self.key_columns}
+                self.messages.put((load_id, 'keys', (store.df, keys, None)))
+                self.messages.put((load_id, 'store', store))
+                return
+
+            df = pd.read_pickle(file_path)
+            key_dtypes = categorize_keys(df)
+            keys = {column: np.asarray(df[column].unique()) for column in self.key_columns}
+            self.messages.put((load_id, 'keys', (df, keys, key_dtypes)))
+
+            if load_id != self.load_id:
+                return
+
+            store = ResultStore(df)
+            self.messages.put((load_id, 'store', store))
+
+        except Exception as e:
+            traceback.print_exc()
+            self.messages.put((load_id, 'error', e))
+            return
+
+        try:
+            write_cache(file_path, store)
+        except OSError:  # e.g. a read-only directory, the pickle is read again next time
+            traceback.print_exc()
+
+        return
@@ -4,11 +4,21 @@
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-import matplotlib, scipy, subprocess, os
-matplotlib.use('TkAgg')
+import matplotlib, scipy, subprocess, os, io, time, multiprocessing
 from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.collections import PathCollection
+from matplotlib.figure import Figure
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from fit import Fit
+from result_store import ResultStore
+from export_manifest import ExportManifest, plot_hash
+from result_cache import open_cache
+
+try:
+    from pypdf import PdfWriter  # merges pages rendered by worker processes (parallel PDF export)
+except ImportError:
+    PdfWriter = None
 
 plt.rcParams.update({
     'figure.facecolor': '#eceff4',
@@ -20,9 +30,54 @@ plt.rcParams.update({
     'text.color': '#455669',
 })
 
+# Plot appearance for better performance (set once here rather than in plot(), which may run on a worker thread)
+plt.rcParams['font.family'] = 'Arial'
+plt.rcParams['path.simplify'] = True
+plt.rcParams['path.simplify_threshold'] = 0.75
+
+# Part of the hash of every exported plot (see export_manifest.py). Bump when the appearance of exports changes, so
+# that incremental exports re-render everything.
+export_style = 1
+
+def dose_grid(volumes, num: int = 100) -> np.ndarray:
+    """Dense, log-spaced dose grid (nL) that spans every dose in volumes. Shared by all curves on a subplot.
+
+    Keyword arguments:
+    :param volumes: iterable of dose arrays (one per replicate)
+    :param num: number of grid points
+    """
+
+    volumes = [np.asarray(v, dtype=float) for v in volumes]
+    doses = np.concatenate(volumes) if volumes else np.empty(0)
+    doses = doses[np.isfinite(doses) & (doses > 0)]
+
+    if not doses.size:
+        return doses
+
+    return np.logspace(np.log10(doses.min()), np.log10(doses.max()), num)
+
+def evaluate_curves(x_grid, einf, ec50, hill_slope, gr: bool = False) -> np.ndarray:
+    """Evaluates every fitted Hill (or GR Hill) curve on x_grid with a single broadcast call.
+
+    Keyword arguments:
+    :param x_grid: 1-D array of doses shared by all curves
+    :param einf: 1-D array of Einf (or GRinf), one entry per curve
+    :param ec50: 1-D array of EC50, one entry per curve
+    :param hill_slope: 1-D array of Hill slopes, one entry per curve
+    :param gr: use Fit().GR_Hill instead of Fit().Hill
+    :return: 2-D array of shape (number of curves, len(x_grid))
+    """
+
+    f = Fit()
+    model = f.GR_Hill if gr else f.Hill
+    x_grid = np.asarray(x_grid, dtype=float)[np.newaxis, :]
+    einf, ec50, hill_slope = (np.asarray(p, dtype=float)[:, np.newaxis] for p in (einf, ec50, hill_slope))
+
+    return model(x_grid, einf, ec50, hill_slope)
+
 def plot(df: pd.DataFrame, axs: matplotlib.axes.Axes | np.ndarray, drug: str,
          strains: list | np.ndarray, timepoints: list | np.ndarray, row_indices=None, subplot: int = 0, save_type=None,
-         gr: bool = False) -> None:
+         gr: bool = False, store: ResultStore = None) -> None:
     """"Plots all replicates for a given drug. Allows for the overlay of different strains or timepoints.
 
     Keyword arguments:
@@ -31,40 +86,88 @@ def plot(df: pd.DataFrame, axs: matplotlib.axes.Axes | np.ndarray, drug: str,
     :param strains: list of strains where each strain is a str
     :param axs: matplotlib.axes.Axes from plt.subplots
     :param subplot: index of axs object to draw on
+    :param store: ResultStore built from the full DataFrame (built from df if not given)
     """
 
-    # Plot appearance for better performance
-    plt.rcParams['font.family'] = 'Arial'
-    plt.rcParams['path.simplify'] = True
-    plt.rcParams['path.simplify_threshold'] = 0.75
+    if isinstance(axs, np.ndarray):  # checks for existence of subplot else it's a specific axs obj
+        axs = axs.flatten()[subplot]
+
+    if store is None:
+        store = ResultStore(df)
+
+    elements = plot_elements(store, drug, strains, timepoints, row_indices=row_indices, save_type=save_type, gr=gr)
+
+    if elements is None:
+        return "Can't have multiple strains AND timepoints!"
+
+    draw_elements(axs, elements)
+
+    return elements['rep_locs']
+
+def plot_elements(store: ResultStore, drug: str, strains: list | np.ndarray, timepoints: list | np.ndarray,
+                  row_indices=None, save_type=None, gr: bool = False) -> dict | None:
+    """Everything plot() draws for a given drug, as data: line and scatter artists (x, y, artist properties), title,
+    axis labels, y limits, and the integer-label (.loc) of replicates. None if multiple strains AND timepoints are given.
+    'line_replicates' and 'scatter_replicates' hold the replicate (number within the subplot, row label) of every
+    artist, in the same order as 'lines' and 'scatters'.
+
+    Format:
+    {'lines': [(x, y, kwargs)], 'scatters': [(x, y, kwargs)], 'title': str, 'xlabel': str, 'ylabel': str,
+     'ylim': tuple | None, 'rep_locs': list, 'line_replicates': [(int, label)], 'scatter_replicates': [(int, label)]}
+    """
 
     # Set1 has a max of 9 colors
     colors = plt.cm.Set1.colors
     strain_palette = dict(zip(sorted(strains),colors[:len(strains)]))
     timepoint_palette = dict(zip(sorted(timepoints),colors[:len(timepoints)]))
 
-    f = Fit()
     seen_strains = seen_timepoints = set()
     rep_locs = list()
+    lines, scatters, ylim = list(), list(), None
+    line_replicates, scatter_replicates = list(), list()
 
-    if isinstance(axs, np.ndarray):  # checks for existence of subplot else it's a specific axs obj
-        axs = axs.flatten()[subplot]
-
-    # Row indices for all (three) replicates matching the specified strain(s), drug, and timepoint(s) criteria
+    # Row positions for all (three) replicates matching the specified strain(s), drug, and timepoint(s) criteria
     if row_indices is None:
-        row_indices = df[(df['Drug'] == drug) & (df['Strain'].isin(strains)) & (df['Timepoint'].isin(timepoints))].index
+        positions = store.positions([drug], strains, timepoints)
+    else:
+        positions = store.positions_of(row_indices)
+
+    row_indices = store.labels(positions)
+
+    # Curve fit parameters of every replicate as array slices. Growth rate fits fall back to dose response fits.
+    dr_fits = store.fits('dr', positions)
+    gr_fits = store.fits('gr', positions)
+    has_dr = ~np.isnan(dr_fits['Einf'])
+    has_gr = ~np.isnan(gr_fits['Einf']) if gr else np.zeros(len(positions), dtype=bool)
+
+    # Scatter data for every replicate as views into the packed dose/response buffers (log10 volumes are precomputed)
+    responses = store.growth_inhibitions if not gr else store.norm_gr
+    replicates = list()
+
+    for pos, row_idx, strain, timepoint, fitted in zip(positions, row_indices, store.keys['Strain'][positions],
+                                                       store.keys['Timepoint'][positions], has_dr):
+        replicates.append((row_idx, strain, timepoint, bool(fitted), store.log_volumes[pos], responses[pos]))
+
+    # Every fitted curve of the subplot is evaluated in one broadcast call per model on a shared dose grid
+    x_grid = dose_grid([store.volumes[pos] for pos in positions])
+    curves = dict()  # replicate number -> (y_pred, r2, model)
 
-    for i, row_idx in enumerate(row_indices): # for each replicate, for each strain, for each timepoint
-        row = df.loc[row_idx]
-        strain = row['Strain']
-        timepoint = row['Timepoint']
-        algo = row['Best Algo']
+    for model, fits, reps in [('GR_Hill', gr_fits, has_gr), ('Hill', dr_fits, has_dr & ~has_gr)]:
+        if reps.any():
+            y_preds = evaluate_curves(x_grid, fits['Einf'][reps], fits['EC50'][reps], fits['Hill Slope'][reps],
+                                      gr=(model == 'GR_Hill'))
+            r2 = np.round(fits['R_squared'][reps], 3)
+            curves.update({int(rep): (y_pred, r, model) for rep, y_pred, r in zip(np.flatnonzero(reps), y_preds, r2)})
 
+    log_x_grid = np.log10(x_grid)
+
+    # Artists for every replicate
+    for i, (row_idx, strain, timepoint, fitted, log_x, y) in enumerate(replicates):
         ## Adjusting color and legend depending on len() of strains and timepoints
         # Single strain and timepoint (assumes max of 3 replicates)
         if len(strains) == 1 and len(timepoints) == 1:
             color = ['red','blue','green'][i]
-            rep_locs.append(row_idx if algo else algo) # only returns non-empty list for single strain and timepoint
+            rep_locs.append(row_idx if fitted else None) # only returns non-empty list for single strain and timepoint
             legend_label = f'R{i+1}'
 
         # Multiple strains and single timepoint
@@ -84,72 +187,138 @@ def plot(df: pd.DataFrame, axs: matplotlib.axes.Axes | np.ndarray, drug: str,
                 seen_timepoints.add(timepoint)
 
         else:
-            return "Can't have multiple strains AND timepoints!"
-
-        # x,y for scatter plot
-        x = row['Volume']
-        y = row['Growth Inhibitions'] if not gr else row['gr']['norm_gr']
-
-        # Allows/ensures indexing of axs obj
-        # if isinstance(axs, np.ndarray): # checks for existence of subplot
-        #     if axs.ndim == 2: # if more than one row to display plots
-        #         axs = axs.flatten()[subplot]
-        #     else:
-        #         axs = axs[subplot]
-
-        # Conditionals for whether a curve fit exists for dose response or growth rate
-        if gr and (grinf := row['gr']['Einf']):
-            ec50 = row['gr']['EC50']
-            hill_slope = row['gr']['Hill Slope']
-            r2 = np.round(row['gr']['R_squared'],3)
-
-            y_pred = f.GR_Hill(x, grinf, ec50, hill_slope)
-            axs.set_ylim(-1,1)
-            axs.plot(np.log10(x), y_pred, color=color, ls='--', label=r2 if len(row_indices) == 1 else legend_label,
-                     alpha=0.5)  # curve fit only if algo
+            return None
 
-        else:
-            if algo:
-                einf = row[algo]['Einf']
-                ec50 = row[algo]['EC50']
-                hill_slope = row[algo]['Hill Slope']
-                r2 = np.round(row[algo]['R_squared'],3)
-
-                y_pred = f.Hill(np.array(x), einf, ec50, hill_slope)
-                axs.set_ylim(0, 1)
-                axs.plot(np.log10(x), y_pred, color=color, ls='--', label=r2 if len(row_indices) == 1 else legend_label,
-                         alpha=0.5) # curve fit only if algo
-
-        axs.scatter(np.log10(x), y, marker='o', color=color, antialiased=False, alpha=0.6)
-        axs.grid(color='white', linestyle='-.', linewidth=0.9, alpha=0.9)
+        # Curve fit only if algo (or growth rate fit). Properties are complete so that artists can be re-used.
+        if i in curves:
+            y_pred, r2, model = curves[i]
+            ylim = (-1, 1) if model == 'GR_Hill' else (0, 1)
+            lines.append((log_x_grid, y_pred, {'color': color, 'ls': '--', 'alpha': 0.5, 'antialiased': True,
+                                               'label': r2 if len(row_indices) == 1 else legend_label}))
+            line_replicates.append((i, row_idx))
+
+        scatters.append((log_x, y, {'marker': 'o', 'color': color, 'antialiased': False, 'alpha': 0.6}))
+        scatter_replicates.append((i, row_idx))
 
         # When plots are separated by strain, timepoint, and replicate
         if len(strains) == 1 and len(timepoints) == 1 and len(row_indices) == 1:
-            axs.plot(np.log10(x), y, color='black', antialiased=False, alpha=0.35)
+            lines.append((log_x, y, {'color': 'black', 'ls': '-', 'alpha': 0.35, 'antialiased': False,
+                                     'label': '_nolegend_'}))
+            line_replicates.append((i, row_idx))
 
     if save_type == 'pdf':
-        axs.set_title(f"{drug}")
+        title = f"{drug}"
         if len(strains) == 1 and len(timepoints) == 1 and len(row_indices) == 1:
-            axs.set_title(f"{drug} \u2022 {strain} \u2022 {timepoint}")
+            title = f"{drug} \u2022 {strain} \u2022 {timepoint}"
     else:
-        axs.set_title(f"{drug} {'Dose response' if not gr else 'Growth rate'} curves for {', '.join(strains)}")
+        title = f"{drug} {'Dose response' if not gr else 'Growth rate'} curves for {', '.join(strains)}"
+
+    return {'lines': lines, 'scatters': scatters, 'title': title, 'xlabel': 'Volume (log10) (nL)',
+            'ylabel': f'{'Growth inhibitions' if not gr else 'Normalized growth rate'}', 'ylim': ylim,
+            'rep_locs': rep_locs, 'line_replicates': line_replicates, 'scatter_replicates': scatter_replicates}
+
+def draw_elements(axs: matplotlib.axes.Axes, elements: dict | None, reuse: bool = False) -> None:
+    """Draws the output of plot_elements() on axs. With reuse, the Line2D and PathCollection artists already on axs are
+    given the new data instead of being rebuilt (artists are only added or removed when their count differs), and
+    elements=None leaves a blank subplot.
 
-    axs.set(xlabel='Volume (log10) (nL)', ylabel=f'{'Growth inhibitions' if not gr else 'Normalized growth rate'}')
-    axs.legend(frameon=False)
+    Keyword arguments:
+    :param axs: matplotlib.axes.Axes
+    :param elements: dict from plot_elements() or None
+    :param reuse: swap the data of existing artists (e.g. for pooled figures)
+    """
+
+    elements = elements or {'lines': [], 'scatters': [], 'title': '', 'xlabel': '', 'ylabel': '', 'ylim': None}
+    old_lines = list(axs.lines) if reuse else list()
+    old_scatters = [c for c in axs.collections if isinstance(c, PathCollection)] if reuse else list()
 
-    return rep_locs
+    for i, (x, y, kwargs) in enumerate(elements['lines']):
+        if i < len(old_lines):
+            old_lines[i].set_data(x, y)
+            old_lines[i].set(**kwargs)
+        else:
+            axs.plot(x, y, **kwargs)
+
+    for i, (x, y, kwargs) in enumerate(elements['scatters']):
+        if i < len(old_scatters):
+            old_scatters[i].set_offsets(np.column_stack([x, y]))
+            old_scatters[i].set(color=kwargs['color'], alpha=kwargs['alpha'])
+        else:
+            axs.scatter(x, y, **kwargs)
 
-def generate_plot_images(df, drugs, strains, timepoints, save_path, save_type, batch_size, gr=False, partition=False):
-    """"Generates individual dose response plot as png or as a batch of 3 plots per page in a pdf file
+    for artist in old_lines[len(elements['lines']):] + old_scatters[len(elements['scatters']):]:
+        artist.remove()
+
+    has_data = bool(elements['lines'] or elements['scatters'])
+
+    # Data limits of re-used artists are not updated by set_data/set_offsets (and relim ignores collections)
+    if reuse:
+        axs.relim()
+        for x, y, _ in elements['scatters']:
+            axs.update_datalim(np.column_stack([x, y]))
+
+        axs.set_autoscale_on(True)
+        axs.autoscale_view()
+
+        if not has_data:  # same limits as a new, empty axs
+            axs.set_xlim(0, 1)
+            axs.set_ylim(0, 1)
+
+    if elements['ylim']:
+        axs.set_ylim(*elements['ylim'])
+
+    axs.set_title(elements['title'])
+    axs.set(xlabel=elements['xlabel'], ylabel=elements['ylabel'])
+
+    if has_data:
+        axs.grid(color='white', linestyle='-.', linewidth=0.9, alpha=0.9)
+        axs.legend(frameon=False)
+    else:
+        axs.grid(False)
+        if axs.get_legend():
+            axs.get_legend().remove()
+
+    return
+
+def generate_plot_images(df, drugs, strains, timepoints, save_path, save_type, batch_size, gr=False, partition=False,
+                         store=None, workers: int = 1, progress=None, cancelled=None, incremental: bool = False,
+                         raster_dpi: int | None = None, page_stats=None) -> bool:
+    """"Generates individual dose response plot as png or as a batch of 3 plots per page in a pdf file. Returns False if
+    the export was cancelled (no PDF file is written then, PNG images that were already saved are kept).
+
+    Every export is written into a new subdirectory of save_path (e.g. 2025-09-25_png_export_1), so file names within
+    it never collide.
+
+    With incremental, save_path is treated as an export directory with a manifest.json (see export_manifest.py) and
+    stable file names: only plots (or PDF pages) whose inputs changed since the last export into it are re-rendered, and
+    an interrupted export resumes where it stopped.
+
+    With raster_dpi (compact PDF), the curves and scatter markers of every subplot are rasterized at raster_dpi while
+    text, axes, and legends stay vectors. Pages with many replicates become much smaller and faster to open.
 
         Keyword arguments:
         :param df: pd.DataFrame of MK DiaMOND pipeline
         :param drugs: np.ndarray or list() of drugs for which a plot will be made
         :param strains: list() of strains to superimpose on each plot
-        :param save_path: file path to save png images (pathlib obj)
+        :param save_path: directory in which the export directory is created (pathlib obj)
+        :param store: ResultStore of the full DataFrame (built from df if not given)
+        :param workers: number of worker processes that render PDF pages (1 renders them in this process)
+        :param progress: callable(done, total) that is called after every page or image
+        :param cancelled: threading.Event that stops the export once it is set
+        :param incremental: re-render only what changed since the last export into save_path (which is used as is)
+        :param raster_dpi: dpi of rasterized data artists in PDF pages (None keeps everything as vectors)
+        :param page_stats: PageStats that records the render time and size of every PDF page (and the PDF file)
     """
-    save_path = Path(save_path)
+    store = ResultStore(df) if store is None else store
+    source = df if store.cache_path is None else store.cache_path  # what export workers build their store from
     row_indices = df.index  # where each index is a row (and individual plot) for all data to be plotted
+    report = progress or (lambda done, total: None)
+
+    if incremental:
+        save_path = Path(save_path)
+        save_path.mkdir(parents=True, exist_ok=True)
+    else:
+        save_path = export_directory(save_path, save_type)
 
     if save_type == 'pdf':
         if batch_size == 2:
@@ -164,76 +333,481 @@ def generate_plot_images(df, drugs, strains, timepoints, save_path, save_type, b
         else:
             batches = [drugs[i:i + batch_size] for i in range(0, len(drugs), batch_size)]
 
-        with PdfPages(unique_filename(save_path / 'hillcurves.pdf')) as pdf:
-            for b in batches:  # each batch is a page on the pdf
-                fig, axs = plt.subplots(nrows=1, ncols=batch_size, facecolor='white', figsize=fig_size)
-                axs = axs.flatten() if isinstance(axs, np.ndarray) else axs
-                plt.suptitle(f'Dose Response Curves for {", ".join(strains)}')
+        page_args = [(list(b), batch_size, fig_size, list(strains), list(timepoints), gr, partition, raster_dpi)
+                     for b in batches]
+        workers = min(workers, len(batches))
+        page_stats = PageStats() if page_stats is None else page_stats
 
-                for i_element, element in enumerate(b): # an element is either a drug:str or a pandas.Index for a the .loc of a row
-                    if partition:
-                        row = df.loc[element]
-                        d = row['Drug']
-                        s= row['Strain']
-                        t = row['Timepoint']
+        if incremental and PdfWriter is not None:
+            return incremental_pdf(store, source, page_args, save_path, workers, report, cancelled, page_stats)
 
-                        plot(df, axs, drug=d, strains=[s], timepoints=[t],
-                                        row_indices=[element],
-                                        subplot=i_element, save_type='pdf', gr=gr)
+        if PdfWriter is not None:
+            # Pages are rendered as single-page PDFs (by the workers if workers > 1) and merged in the order of batches
+            # (groupings), so that the size of every page is known
+            writer = PdfWriter()
+            pages = export_results(lambda args: rendered_pdf_page(store, args), export_pdf_page, page_args, workers,
+                                   source, cancelled)
+
+            for i_page, (page, seconds) in enumerate(pages, start=1):
+                writer.append(io.BytesIO(page))
+                page_stats.add(seconds, len(page))
+                report(i_page, len(page_args))
+
+            if is_cancelled(cancelled):
+                remove_if_empty(save_path)
+                return False
+
+            writer.compress_identical_objects()  # fonts are embedded once per single-page PDF
+
+            file_name = unique_filename(save_path / 'hillcurves.pdf')
+            with open(file_name, 'wb') as f:
+                writer.write(f)
+
+        else:
+            file_name = unique_filename(save_path / 'hillcurves.pdf')
+            figs = export_results(lambda args: (time.perf_counter(), pdf_page(store, *args)), None, page_args, 1,
+                                  source, cancelled)
 
-                    else:
-                        plot(df, axs, strains=strains, drug=element,
-                                        timepoints=timepoints,
-                                        subplot=i_element, save_type='pdf', gr=gr)
+            with PdfPages(file_name) as pdf:
+                for i_page, (start, fig) in enumerate(figs, start=1):  # each batch is a page on the pdf
+                    pdf.savefig(fig)
+                    page_stats.add(time.perf_counter() - start, None)  # images and fonts are only written on close
+                    report(i_page, len(page_args))
 
-                    axs[i_element].set_facecolor('#EAEAF2')
+            if is_cancelled(cancelled):
+                Path(file_name).unlink(missing_ok=True)  # PdfPages only creates the file with its first page
+                remove_if_empty(save_path)
+                return False
 
-                pdf.savefig(fig)
-                plt.close(fig)
+        page_stats.file_name, page_stats.file_size = file_name, os.path.getsize(file_name)
 
     elif save_type == 'png':
-        iterable = row_indices if partition else drugs
+        iterable = list(row_indices if partition else drugs)
 
-        for i_element, element in enumerate(iterable):
-            fig, axs = plt.subplots(1, 1, facecolor='white')
+        # File names are reserved up front so that worker processes never race for the same name
+        if partition:
+            labels = [store.keys['Drug'][position] for position in store.positions_of(iterable)]
+        else:
+            labels = iterable
+
+        base_filenames = [save_path / f"{", ".join(strains)}_{label}.png" for label in labels]
+        file_names = numbered_filenames(base_filenames) if incremental else unique_filenames(base_filenames)
+        image_args = [(element, file_name, list(strains), list(timepoints), gr, partition)
+                      for element, file_name in zip(iterable, file_names)]
+
+        # Incremental: images that exist with unchanged inputs are skipped
+        if incremental:
+            manifest = ExportManifest(save_path / 'manifest.json')
+            names = [Path(file_name).name for file_name in file_names]
+            digests = [plot_hash([export_elements(store, element, list(strains), list(timepoints), gr, partition,
+                                                  save_type=None)], 'png', export_style, matplotlib.__version__)
+                       for element in iterable]
+            pending = [i for i, (name, digest) in enumerate(zip(names, digests)) if not manifest.is_current(name, digest)]
+        else:
+            pending = list(range(len(image_args)))
+
+        workers = min(workers, len(pending))
+        fig = png_figure() if workers <= 1 else None
+        skipped = len(image_args) - len(pending)
+
+        if not pending:
+            report(len(image_args), len(image_args))
+
+        images = export_results(lambda args: png_image(store, fig, *args), export_png_image,
+                                [image_args[i] for i in pending], workers, source, cancelled)
 
-            if partition:
-                row = df.loc[element]
-                d = row['Drug']
-                s = row['Strain']
-                t = row['Timepoint']
+        for i_image, _ in enumerate(images, start=1):
+            if incremental:
+                i = pending[i_image - 1]
+                manifest.update(names[i], digests[i])
 
-                plot(df, axs, drug=d, strains=[s], timepoints=[t], row_indices=[element],
-                     subplot=0, save_type='pdf', gr=gr)
+            report(skipped + i_image, len(image_args))
 
-            else:
-                plot(df, axs, drug=element, strains=strains, timepoints=timepoints, row_indices=None,
-                     subplot=0, gr=gr)
+        if incremental:
+            # Images that are no longer part of the export (like the pages of incremental_pdf)
+            if not is_cancelled(cancelled):
+                for name in [name for name in manifest.entries if name.endswith('.png') and name not in names]:
+                    manifest.remove(name)
 
-            axs.set_facecolor('#EAEAF2')
-            fig.savefig(unique_filename(save_path / f"{", ".join(strains)}_{d if partition else element}.png"))
-            plt.close(fig)
+                for image_path in save_path.glob('*.png'):
+                    if image_path.name not in names:
+                        image_path.unlink()
+
+            manifest.save()
+
+        if is_cancelled(cancelled):
+            remove_if_empty(save_path)
+            return False
 
     # subprocess.run(["open", save_path])
 
+    return True
+
+def export_results(serial, parallel, args_list: list, workers: int, source, cancelled=None):
+    """Yields the result of every args in args_list, in order. With workers > 1, parallel(args) runs in a pool of
+    worker processes (see init_export_worker), otherwise serial(args) runs in this process. Stops once cancelled is set
+    (work that is queued in the pool is dropped).
+
+    Keyword arguments:
+    :param serial: callable(args) used without worker processes
+    :param parallel: picklable callable(args) used in worker processes
+    :param source: rows of the export (pd.DataFrame) or the cache directory of the store (see init_export_worker)
+    :param cancelled: threading.Event or None
+    """
+
+    if workers > 1:
+        chunksize = max(1, len(args_list) // (workers * 4))
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=pool_context(), initializer=init_export_worker,
+                                       initargs=(source,))
+
+        try:
+            for result in executor.map(parallel, args_list, chunksize=chunksize):
+                if is_cancelled(cancelled):
+                    break
+
+                yield result
+
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    else:
+        for args in args_list:
+            if is_cancelled(cancelled):
+                break
+
+            yield serial(args)
+
     return
 
+def pool_context():
+    """Start method of export worker processes. Never fork: exports are started from threads (ExportQueue) while other
+    threads (FrameRenderer, FileLoader) may hold locks that a forked child would inherit locked. Workers of forkserver
+    and spawn re-import the main module (without running its __main__ block)."""
+
+    methods = multiprocessing.get_all_start_methods()
+
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+def is_cancelled(cancelled) -> bool:
+    return cancelled is not None and cancelled.is_set()
+
+def pdf_page(store: ResultStore, batch: list, batch_size: int, fig_size: tuple, strains: list, timepoints: list,
+             gr: bool = False, partition: bool = False, raster_dpi: int | None = None) -> Figure:
+    """One page of the PDF export as a matplotlib Figure (no pyplot, so that it can be used in worker processes).
+
+    Keyword arguments:
+    :param store: ResultStore that contains every row of the export
+    :param batch: drugs, or row labels (.loc) if partition, with one subplot each
+    :param batch_size: number of subplots per page
+    :param fig_size: figure size in inches
+    :param raster_dpi: rasterizes the lines and scatters of every subplot at this dpi (compact PDF)
+    """
+
+    # The figure dpi is the resolution of rasterized artists in a PDF, vectors do not depend on it
+    fig = Figure(figsize=fig_size, facecolor='white', dpi=raster_dpi or matplotlib.rcParams['figure.dpi'])
+    axs = fig.subplots(nrows=1, ncols=batch_size, squeeze=False).flatten()
+    fig.suptitle(f'Dose Response Curves for {", ".join(strains)}')
+
+    for i_element, element in enumerate(batch): # an element is either a drug:str or a pandas.Index for a the .loc of a row
+        elements = export_elements(store, element, strains, timepoints, gr, partition)
+
+        if elements:
+            draw_elements(axs[i_element], elements)
+
+        # Consecutive rasterized artists are drawn into one image per subplot
+        if raster_dpi:
+            for artist in [*axs[i_element].lines, *axs[i_element].collections]:
+                artist.set_rasterized(True)
+
+        axs[i_element].set_facecolor('#EAEAF2')
+
+    return fig
+
+def export_elements(store: ResultStore, element, strains: list, timepoints: list, gr: bool = False,
+                    partition: bool = False, save_type='pdf') -> dict | None:
+    """plot_elements() of one element of an export: a drug, or a row label (.loc) if partition (which always uses the
+    'pdf' title)."""
+
+    if partition:
+        position = store.positions_of([element])[0]
+        d, s, t = (store.keys[column][position] for column in store.key_columns)
+
+        return plot_elements(store, d, strains=[s], timepoints=[t], row_indices=[element], save_type='pdf', gr=gr)
+
+    return plot_elements(store, element, strains=strains, timepoints=timepoints, save_type=save_type, gr=gr)
+
+def incremental_pdf(store: ResultStore, source, page_args: list, save_path: Path, workers: int, report,
+                    cancelled=None, page_stats=None) -> bool:
+    """Incremental PDF export (see generate_plot_images). Every page is kept as a single-page PDF named after the hash
+    of its inputs in save_path / 'pages', only missing pages are rendered, and hillcurves.pdf is merged from the pages.
+    Pages are written as soon as they are rendered, so an interrupted export resumes with the remaining pages."""
+
+    pages_path = save_path / 'pages'
+    pages_path.mkdir(parents=True, exist_ok=True)
+    manifest = ExportManifest(save_path / 'manifest.json')
+
+    digests = [plot_hash([export_elements(store, element, strains, timepoints, gr, partition)
+                          for element in batch], 'pdf', batch_size, fig_size, strains, raster_dpi, export_style,
+                         matplotlib.__version__)
+               for batch, batch_size, fig_size, strains, timepoints, gr, partition, raster_dpi in page_args]
+    page_stats = PageStats() if page_stats is None else page_stats
+    file_name = save_path / 'hillcurves.pdf'
+
+    if manifest.is_current('hillcurves.pdf', digests):
+        page_stats.file_name, page_stats.file_size = str(file_name), os.path.getsize(file_name)
+        report(len(page_args), len(page_args))
+        return True
+
+    pending = [i for i, digest in enumerate(digests) if not (pages_path / f'{digest}.pdf').exists()]
+    skipped = len(page_args) - len(pending)
+    pages = export_results(lambda args: rendered_pdf_page(store, args), export_pdf_page,
+                           [page_args[i] for i in pending], min(workers, len(pending)), source, cancelled)
+
+    for i_page, (page, seconds) in enumerate(pages, start=1):  # only pages that are rendered are recorded
+        temp_path = pages_path / f'{digests[pending[i_page - 1]]}.pdf.tmp'
+        temp_path.write_bytes(page)
+        os.replace(temp_path, temp_path.with_suffix(''))
+        page_stats.add(seconds, len(page))
+        report(skipped + i_page, len(page_args))
+
+    if is_cancelled(cancelled):
+        return False
+
+    writer = PdfWriter()
+    for digest in digests:
+        writer.append(str(pages_path / f'{digest}.pdf'))
+
+    writer.compress_identical_objects()  # fonts are embedded once per single-page PDF
+
+    temp_path = save_path / 'hillcurves.pdf.tmp'
+    with open(temp_path, 'wb') as f:
+        writer.write(f)
+
+    os.replace(temp_path, file_name)
+    page_stats.file_name, page_stats.file_size = str(file_name), os.path.getsize(file_name)
+
+    # Pages that are no longer part of the export
+    for page_path in pages_path.glob('*.pdf'):
+        if page_path.stem not in digests:
+            page_path.unlink()
+
+    manifest.update('hillcurves.pdf', digests)
+    manifest.save()
+
+    return True
+
+def png_figure() -> Figure:
+    """Figure for png_image(), re-used for every image of a PNG export."""
+
+    fig = Figure(facecolor='white')
+    fig.subplots(1, 1)
+
+    return fig
+
+def png_image(store: ResultStore, fig: Figure, element, file_name, strains: list, timepoints: list, gr: bool = False,
+              partition: bool = False):
+    """Swaps the plot of one drug (or one row if partition) into the axes of fig (see png_figure()) and saves it.
+
+    Keyword arguments:
+    :param store: ResultStore that contains every row of the export
+    :param fig: Figure from png_figure(), its axes are cleared and re-used between images
+    :param element: drug, or row label (.loc) if partition
+    :param file_name: path of the png file
+    """
+
+    axs = fig.axes[0]
+    elements = export_elements(store, element, strains, timepoints, gr, partition, save_type=None)
+
+    draw_elements(axs, elements, reuse=True)
+    axs.set_facecolor('#EAEAF2')
+    fig.savefig(file_name)
+
+    return
+
+# ResultStore of the exported rows and re-used PNG figure in an export worker process (see init_export_worker)
+export_store = None
+export_figure = None
+
+def init_export_worker(source):
+    """ProcessPoolExecutor initializer. Builds the ResultStore (and the PNG figure) once per worker process rather
+    than once per page or image. source is the DataFrame of the exported rows, or the cache directory of a store that
+    was opened from its cache (its df lacks the columns a store is built from), which is memory-mapped instead."""
+
+    global export_store, export_figure
+    export_store = ResultStore(source) if isinstance(source, pd.DataFrame) else open_cache(source)
+    export_figure = png_figure()
+
+    return
+
+def export_pdf_page(args: tuple) -> tuple:
+    """Renders one page of the PDF export (args of pdf_page() without the store) in a worker process (see
+    rendered_pdf_page())."""
+
+    return rendered_pdf_page(export_store, args)
+
+def rendered_pdf_page(store: ResultStore, args: tuple) -> tuple:
+    """(bytes of a single-page PDF, seconds it took to build and save) of one page of the PDF export."""
+
+    start = time.perf_counter()
+    page = pdf_page_bytes(pdf_page(store, *args))
+
+    return page, time.perf_counter() - start
+
+def pdf_page_bytes(fig: Figure) -> bytes:
+    """fig saved as a single-page PDF."""
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='pdf')
+
+    return buffer.getvalue()
+
+def export_png_image(args: tuple):
+    """Saves one image of the PNG export (args of png_image() without the store and figure) in a worker process."""
+
+    png_image(export_store, export_figure, *args)
+
+    return
+
+class PageStats:
+    """Render time and size of every page of a PDF export, and the size of the PDF file, for choosing export settings
+    (e.g. compact raster_dpi). The size of a page is that of a single-page PDF, which includes its own fonts (they are
+    only embedded once in the merged file). Without pypdf, page sizes are unknown (None)."""
+
+    def __init__(self):
+        self.pages = list()  # (seconds, bytes) per page
+        self.file_name = None
+        self.file_size = None
+
+    def add(self, seconds: float, nbytes: int | None):
+        self.pages.append((seconds, nbytes))
+
+        return
+
+    def summary(self) -> str:
+        """e.g. '24 pages, 1.2 MB, 0.21 s/page (max 0.40 s)'"""
+
+        parts = list()
+
+        if self.pages:
+            seconds = [s for s, _ in self.pages]
+            parts.append(f'{len(self.pages)} pages')
+
+        if self.file_size is not None:
+            parts.append(format_size(self.file_size))
+
+        if self.pages:
+            parts.append(f'{sum(seconds) / len(seconds):.2f} s/page (max {max(seconds):.2f} s)')
+
+        return ', '.join(parts)
+
+    def table(self) -> str:
+        """One line per page with its render time and size."""
+
+        lines = [f'page {i:>4}  {seconds:6.2f} s  {format_size(nbytes) if nbytes is not None else "-":>9}'
+                 for i, (seconds, nbytes) in enumerate(self.pages, start=1)]
+
+        return '\n'.join(lines)
+
+def format_size(nbytes: int) -> str:
+    for unit in ('B', 'KB', 'MB'):
+        if nbytes < 1024:
+            return f'{nbytes:.0f} {unit}' if unit == 'B' else f'{nbytes:.1f} {unit}'
+        nbytes /= 1024
+
+    return f'{nbytes:.1f} GB'
+
 def unique_filename(base_filename):
-    file_name, ext = os.path.splitext(base_filename)
-    counter = 1
-    new_file_name = f"{file_name}_{counter}{ext}"
+    return FilenameIndex(Path(base_filename).parent).allocate(base_filename)
+
+def numbered_filenames(base_filenames) -> list:
+    """Stable file names for an export directory: equal base file names are numbered _1, _2, ... in order, without
+    looking at files that already exist (which are overwritten)."""
 
-    while os.path.exists(new_file_name):
-        counter += 1
-        new_file_name = f"{file_name}_{counter}{ext}"
+    counters = dict()  # base file name -> last counter used
+    new_file_names = list()
 
-    return new_file_name
+    for base_filename in base_filenames:
+        file_name, ext = os.path.splitext(base_filename)
+        counters[(file_name, ext)] = counters.get((file_name, ext), 0) + 1
+        new_file_names.append(f"{file_name}_{counters[(file_name, ext)]}{ext}")
+
+    return new_file_names
+
+def unique_filenames(base_filenames) -> list:
+    """unique_filename() for many files at once. Equal base file names get consecutive counters, so names are unique
+    before any of the files exist (e.g. when they are written by worker processes). Every directory is only scanned
+    once (see FilenameIndex)."""
+
+    indices = dict()  # directory -> FilenameIndex
+    new_file_names = list()
+
+    for base_filename in base_filenames:
+        directory = Path(base_filename).parent
+
+        if directory not in indices:
+            indices[directory] = FilenameIndex(directory)
+
+        new_file_names.append(indices[directory].allocate(base_filename))
+
+    return new_file_names
+
+class FilenameIndex:
+    """Names in a directory, scanned once, from which unique file names (base_1.ext, base_2.ext, ...) are allocated in
+    memory rather than by probing the file system for every counter."""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.names = {entry.name for entry in os.scandir(self.directory)} if self.directory.is_dir() else set()
+        self.counters = dict()  # base name -> last counter allocated
+
+    def allocate(self, base_filename) -> str:
+        """Unique path in self.directory for the name of base_filename (with _<counter> before the extension)."""
+
+        base_name = Path(base_filename).name
+        file_name, ext = os.path.splitext(base_name)
+        counter = self.counters.get(base_name, 0) + 1
+
+        while f"{file_name}_{counter}{ext}" in self.names:
+            counter += 1
+
+        new_name = f"{file_name}_{counter}{ext}"
+        self.counters[base_name] = counter
+        self.names.add(new_name)
+
+        return str(self.directory / new_name)
+
+def export_directory(save_path, save_type) -> Path:
+    """Creates a new, empty directory for one export in save_path (e.g. 2025-09-25_pdf_export_1)."""
+
+    save_path = Path(save_path)
+    save_path.mkdir(parents=True, exist_ok=True)
+    index = FilenameIndex(save_path)
+
+    while True:
+        export_path = Path(index.allocate(save_path / f'{time.strftime("%Y-%m-%d")}_{save_type}_export'))
+
+        try:
+            export_path.mkdir()
+        except FileExistsError:  # created by another export since the scan
+            continue
+
+        return export_path
+
+def remove_if_empty(path):
+    """Removes the directory of a cancelled export if nothing was written to it."""
+
+    if path.is_dir() and not any(path.iterdir()):
+        path.rmdir()
+
+    return
 
 
 if __name__ == "__main__":
+    plt.switch_backend('TkAgg')  # the backend is left to the importer otherwise (TkAgg in plot_GUI.py, Agg headless)
     hp_path = '/Users/hidetominitta/Downloads/2025-05-09_result.pkl'
     hp_path = '/Users/hidetominitta/Desktop/DiaMOND/Experiments/BDQ-R/Aux_Validation/results/results_05052025.pkl'
     df = pd.read_pickle(hp_path)
+    store = ResultStore(df)
     drugs = df['Drug'].unique()
     strains = df['Strain'].unique()
     timepoints = df['Timepoint'].unique()
@@ -246,10 +820,10 @@ if __name__ == "__main__":
     for strain in strains[:2]:
         for drug in drugs[-2:]:
             for timepoint in timepoints[:2]:
-                row_indices = df[(df['Drug'] == drug) & (df['Strain'] == strain) & (df['Timepoint'] == timepoint)].index
+                row_indices = store.labels(store.positions([drug], [strain], [timepoint]))
                 for row_index in row_indices:
                     plot(df, axs, drug,strains=[strain],timepoints=[timepoint], row_indices=[row_index], subplot=idx, save_type='pdf',
-                         gr = True)
+                         gr = True, store=store)
                     idx+=1
 
     plt.show()
@@ -0,0 +1,183 @@
+# ms_journal.py
+# Name: Hidetomi Nitta
+# Purpose: Append-only sidecar journal of manual selections (MS_Flag), folded back into the result pickle on request
+
+# Usage (folds the journal of a result pickle into its MS_Flag column, e.g. before running the pipeline on it):
+# python ms_journal.py results.pkl
+
+import json, os, sys, time
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from result_cache import update_source
+
+
+class SelectionJournal:
+    """<name>.pkl.ms.jsonl next to a result pickle. Every confirmed manual selection is appended as one line with the
+    row labels whose MS_Flag changed, so a save costs O(changes) and never touches the pickle. self.compact() folds the
+    journal into the pickle's MS_Flag column (and removes it).
+
+    Format of the journal (one json object per line):
+    {"version": 1, "source": {"size": int, "mtime_ns": int}}   header, the pickle the labels belong to
+    {"time": float, "reset": true, "flag": [...], "unflag": []}  first entry, flags of the pickle are replaced
+    {"time": float, "flag": [...], "unflag": [...]}             row labels set to 1 / back to NaN
+
+    Every line is fsync'd once written. A line that was cut off by a crash is dropped the next time the journal is
+    opened. A journal whose pickle was changed by something else is renamed to <name>.pkl.ms.jsonl.stale-<time> rather
+    than applied to the wrong rows."""
+
+    version = 1
+
+    def __init__(self, file_path):
+        self.file_path = Path(file_path)
+        self.path = self.file_path.with_name(self.file_path.name + '.ms.jsonl')
+        self.flagged = set()  # row labels with MS_Flag 1 after every entry
+        self.reset = False  # whether the journal replaces the flags of the pickle
+        self.entries = 0
+
+        self.load()
+
+    def load(self):
+        """Replays the journal into self.flagged."""
+
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+
+        complete = data[:data.rfind(b'\n') + 1]
+
+        if len(complete) < len(data):  # torn last line, later appends would be glued onto it
+            os.truncate(self.path, len(complete))
+
+        lines = complete.splitlines()
+
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, ValueError):
+            header = dict()
+
+        if header.get('version') != self.version or header.get('source') != self.source():
+            self.path.rename(self.path.with_name(f'{self.path.name}.stale-{int(time.time())}'))
+            print(f'{self.path} does not belong to the current {self.file_path.name}, it was renamed')
+            return
+
+        for line in lines[1:]:
+            self.apply(json.loads(line))
+
+        return
+
+    def apply(self, entry: dict):
+        if entry.get('reset'):
+            self.flagged.clear()
+            self.reset = True
+
+        self.flagged.difference_update(label_of(label) for label in entry['unflag'])
+        self.flagged.update(label_of(label) for label in entry['flag'])
+        self.entries += 1
+
+        return
+
+    def record(self, flagged) -> int:
+        """Saves flagged (row labels, all other rows are unflagged) as a delta to the current state and returns the
+        number of changed rows. The first entry replaces the flags of the pickle (like writing MS_Flag did)."""
+
+        flagged = set(flagged)
+        entry = {'time': time.time(), 'flag': sorted(flagged - self.flagged, key=str),
+                 'unflag': sorted(self.flagged - flagged, key=str)}
+
+        if not self.reset:
+            entry['reset'] = True
+
+        elif not entry['flag'] and not entry['unflag']:
+            return 0
+
+        if not self.path.exists():
+            self.append({'version': self.version, 'source': self.source()})
+            fsync_directory(self.path.parent)
+
+        self.append(entry)
+        self.apply(entry)
+
+        return len(entry['flag']) + len(entry['unflag'])
+
+    def append(self, obj: dict):
+        """Appends obj as one line in a single write and fsyncs it."""
+
+        line = (json.dumps(obj) + '\n').encode()
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+        try:
+            os.write(fd, line)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        return
+
+    def compact(self, df: pd.DataFrame = None) -> bool:
+        """Writes MS_Flag of the journal into the pickle and removes the journal. df is the DataFrame of the pickle as
+        it is stored (read from the pickle if None). The pickle is replaced atomically, and its sidecar cache stays
+        valid (see result_cache.update_source()). Returns False if there was nothing to fold in."""
+
+        if not self.entries:
+            return False
+
+        if df is None:
+            df = pd.read_pickle(self.file_path)
+
+        if self.reset or 'MS_Flag' not in df.columns:
+            df['MS_Flag'] = np.nan
+
+        df.loc[df.index.isin(list(self.flagged)), 'MS_Flag'] = int(1)
+
+        stat = os.stat(self.file_path)
+        temp_path = self.file_path.with_name(f'{self.file_path.name}.tmp-{os.getpid()}')
+        df.to_pickle(temp_path)
+
+        with open(temp_path, 'rb') as f:
+            os.fsync(f.fileno())
+
+        os.replace(temp_path, self.file_path)
+        fsync_directory(self.file_path.parent)
+        update_source(self.file_path, stat)
+
+        self.path.unlink()
+        self.flagged, self.reset, self.entries = set(), False, 0
+
+        return True
+
+    def source(self) -> dict:
+        stat = os.stat(self.file_path)
+
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def label_of(label):
+    """Row label from json (lists were tuples, e.g. labels of a MultiIndex)."""
+
+    return tuple(label) if isinstance(label, list) else label
+
+def fsync_directory(directory: Path):
+    """Makes a created/replaced directory entry durable (not supported on Windows)."""
+
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+    return
+
+
+if __name__ == '__main__':
+    for file_path in sys.argv[1:]:
+        journal = SelectionJournal(file_path)
+        print(f'{file_path}: ' + (f'{len(journal.flagged)} rows flagged' if journal.compact() else 'nothing to fold in'))
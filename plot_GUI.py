@@ -3,10 +3,7 @@
 # Purpose: Visualize plots for DiaMOND experiments using MK DiaMOND pipeline
 
 # PlotGUI
-# TODO: combos with certain drugs (e.g. all BDQ drugs)
 # TODO: getting rid if vestigials after hitting "run"
-# TODO: blitting for 12 subplots
-# TODO: recursive self.after() calls for plot() function
 
 # GUI hub
 # TODO: Make central GUI portal (dropdown) in order to select between multiple different DiaMOND tools.
@@ -16,16 +13,24 @@
 
 import matplotlib
 matplotlib.use('TkAgg')
+import tkinter
 import customtkinter as ctk
 from customtkinter import filedialog
 from pathlib import Path
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import matplotlib.pyplot as plt
-import pandas as pd
 import numpy as np
-import gc, os, subprocess
-from helper import plot, generate_plot_images
-from custom_widgets import PlotFrame, ParameterCheckbox, PDFToplevel, LabelToplevel, SlidingButton, SlidingFrame
+import os, subprocess
+from helper import plot_elements, draw_elements, generate_plot_images, PageStats
+from rendering import FrameRenderer, RasterCache, frame_figure
+from export_jobs import ExportJob, ExportQueue
+from file_loader import FileLoader
+from ms_journal import SelectionJournal
+from selection_history import SelectionHistory
+from refit import RefitEngine
+from result_store import DrugIndex, restore_keys
+from custom_widgets import (PlotFrame, PDFToplevel, LabelToplevel, ExportToplevel, SlidingButton, SlidingFrame,
+                            CheckList)
 
 ctk.set_appearance_mode('light')
 ctk.set_default_color_theme('green')
@@ -46,6 +51,9 @@ root_color = '#eceff4'
 frame_color = '#d8dee9'
 widget_color = '#eceff4'
 
+# Memory budget (bytes) for the bitmaps of visited display frames (~1.8 MB per frame at the default window size)
+raster_cache_budget = 256 * 1024 ** 2
+
 
 class PlotGUI(ctk.CTk):
     def __init__(self):
@@ -58,11 +66,40 @@ class PlotGUI(ctk.CTk):
         self.grid_rowconfigure(0, weight=1)
         self.grid_columnconfigure(0, weight=1)
 
+        # Offscreen rendering of display frames on a worker thread
+        self.frame_renderer = FrameRenderer()
+        self.render_generation = 0  # incremented whenever display frames are cleared (discards stale renders)
+        self.pending_frames = set()
+        self.rendered_frames = set()  # frames rendered at least once since the display frames were cleared (progress)
+        self.raster_cache = RasterCache(budget=raster_cache_budget)  # i_frame -> (content, renderer), LRU
+        self.frame_pool = dict()  # num_plots -> PlotFrame, re-used by every display frame with that layout
+        self.poll_id = None
+
+        # Exports run as background jobs, one after another
+        self.export_queue = ExportQueue()
+        self.export_jobs = list()
+        self.export_toplevel = None
+        self.export_poll_id = None
+
+        # Result pickles are loaded on a worker thread (checkboxes appear before the fits are indexed)
+        self.file_loader = FileLoader()
+        self.store = None
+        self.key_dtypes = None  # dtypes of the key columns in the pickle (they are categoricals while loaded)
+        self.loading = False
+        self.load_poll_id = None
+        self.ms_journal = None  # manual selections of the file (see SelectionJournal)
+        self.selection_histories = dict()  # file path -> SelectionHistory, kept while the GUI is open
+        self.selection_history = None  # of the current file
+        self.refit_engine = None  # re-fits curves without the replicates selected for removal
+
         ## plot frame
         self.setup_default_state()
         ## parameter frame
         self.setup_parameter_frame()
-        self.bind('<space>', lambda event: self.slide_parameter_frame())
+        self.bind('<space>', self.key_binding(self.slide_parameter_frame))
+        self.bind('<Control-z>', self.key_binding(lambda: self.step_selection_history(redo=False)))
+        self.bind('<Control-y>', self.key_binding(lambda: self.step_selection_history(redo=True)))
+        self.bind('<Control-Shift-Z>', self.key_binding(lambda: self.step_selection_history(redo=True)))
         ### action frame
         self.setup_action_frame()
 
@@ -70,6 +107,19 @@ class PlotGUI(ctk.CTk):
         self.update_idletasks()
         self.resizable(False, False)
 
+    @staticmethod
+    def key_binding(action):
+        """Handler for a key that is bound on the root window. action() is not called while a text entry (e.g. the
+        filter of a CheckList) has the key, so typing never slides frames or clears plots."""
+
+        def handler(event):
+            if isinstance(event.widget, (tkinter.Entry, tkinter.Text)):
+                return
+
+            action()
+
+        return handler
+
     def setup_default_state(self):
         """GUI state that is initialized upon start of the GUI and when the plots are cleared.
 
@@ -77,20 +127,12 @@ class PlotGUI(ctk.CTk):
         master = self, row = 0
         """
 
-        self.destroy_display_frames()
-
-        # Clearing 1-way, 2-way checkboxes
-        if hasattr(self, 'checkboxes'):
-            self.checkboxes['all_singles'].set(False)
-            self.checkboxes['all_combos'].set(False)
+        self.clear_display_frames()
 
-            # Clearing any other selections by accessing tuple in (idx, ParameterCheckbox) form
-            for key, parameter in self.checkboxes.items():
-                if key in ['drugs', 'strains', 'timepoints']:
-                    for checkbox_info in parameter:
-                        checkbox = checkbox_info[1]
-                        if checkbox.get():
-                            checkbox.set(False)
+        # Clearing selections (including 1-way, 2-way)
+        if hasattr(self, 'checklists'):
+            for checklist in self.checklists.values():
+                checklist.clear()
 
         if hasattr(self, 'temp_frame'):
             self.temp_frame.tkraise()
@@ -130,6 +172,7 @@ class PlotGUI(ctk.CTk):
 
             canvas.draw()
             plt.close(fig)
+            self.temp_canvas = canvas  # display frames are rendered offscreen at the size of this canvas
 
             # Initializing progress bar for when rendering large dataframe selections
             self.progress_bar = ctk.CTkProgressBar(master=self.temp_frame, orientation='horizontal', width=450,
@@ -145,7 +188,7 @@ class PlotGUI(ctk.CTk):
         return
 
     def setup_parameter_frame(self):
-        """Frame that holds scrollable frames to allow user to select from drugs, strains, or timepoints
+        """Frame that holds checkbox lists (see CheckList) to allow user to select from drugs, strains, or timepoints
         as well as the initial file selection and generate plot button.
 
         Frame info:
@@ -167,20 +210,23 @@ class PlotGUI(ctk.CTk):
         self.parameter_frame.grid_columnconfigure((0, 1, 2, 3), weight=1)
         self.parameter_frame.grid_propagate(False)
 
-        # drug scrollable
-        self.drugs_scrollable = ctk.CTkScrollableFrame(master=self.parameter_frame, height=160, fg_color=widget_color,
-                                                       corner_radius=15)
-        self.drugs_scrollable.grid(row=0, column=0, padx=7, pady=7, sticky='e')
+        # drug list (1-way and 2-way are its first two items)
+        self.drugs_checklist = CheckList(master=self.parameter_frame, height=160, fixed=2, fg_color=widget_color,
+                                         corner_radius=15)
+        self.drugs_checklist.grid(row=0, column=0, padx=7, pady=7, sticky='e')
 
-        # strain scrollable
-        self.strains_scrollable = ctk.CTkScrollableFrame(master=self.parameter_frame, height=160, fg_color=widget_color,
-                                                         corner_radius=15)
-        self.strains_scrollable.grid(row=0, column=1, padx=7, pady=7)
+        # strain list
+        self.strains_checklist = CheckList(master=self.parameter_frame, height=160, fg_color=widget_color,
+                                           corner_radius=15)
+        self.strains_checklist.grid(row=0, column=1, padx=7, pady=7)
 
-        # timepoint scrollable
-        self.timepoints_scrollable = ctk.CTkScrollableFrame(master=self.parameter_frame, height=160,
-                                                            fg_color=widget_color, corner_radius=15)
-        self.timepoints_scrollable.grid(row=0, column=2, padx=7, pady=7, sticky='w')
+        # timepoint list
+        self.timepoints_checklist = CheckList(master=self.parameter_frame, height=160, fg_color=widget_color,
+                                              corner_radius=15)
+        self.timepoints_checklist.grid(row=0, column=2, padx=7, pady=7, sticky='w')
+
+        self.checklists = {'drugs': self.drugs_checklist, 'strains': self.strains_checklist,
+                           'timepoints': self.timepoints_checklist}
 
         return
 
@@ -214,7 +260,8 @@ class PlotGUI(ctk.CTk):
         # Options for creating specifying type of plot, etc.
         self.dropdown_var = ctk.StringVar(value="Dose response")
 
-        dropdown_options = ['Dose response', 'Growth rate', 'Save to PDF', 'Save to PNGs', 'Manual selection']
+        dropdown_options = ['Dose response', 'Growth rate', 'Save to PDF', 'Save to PNGs', 'Manual selection',
+                            'Write MS to pickle']
         self.dropdown = ctk.CTkOptionMenu(master=self.generation_frame,
                                            values=dropdown_options,
                                            variable=self.dropdown_var)
@@ -228,16 +275,11 @@ class PlotGUI(ctk.CTk):
         return
 
     def update_progress(self, total_batches):
-        """Updates progress bar as each frame is constructed"""
-
-        step_size = (100 / total_batches) / 100
-        current = self.progress_bar.get()
+        """Updates progress bar to the fraction of frames that were constructed (frames arrive through
+        self.poll_renderer, so the mainloop redraws the bar by itself). Prefetches count once, re-renders after a frame
+        was evicted from self.raster_cache do not count again."""
 
-        if current < 1:
-            current += step_size
-            self.progress_bar.set(current)
-            self.after(5)
-            self.update_idletasks()
+        self.progress_bar.set(min(1, len(self.rendered_frames) / total_batches))
 
         return
 
@@ -266,7 +308,8 @@ class PlotGUI(ctk.CTk):
 
     def load_file(self):
         """Requests pickle file which is then used in order to generate checkbox button(s)
-        (using self.generate_checkbox_scrollables) within each scrollable frame (for drugs, strains, and timepoints)."""
+        (using self.populate_checklists) within each checkbox list (for drugs, strains, and timepoints).
+        The file is loaded by self.file_loader on a worker thread and collected by self.poll_loader."""
 
         self.setup_default_state()
         initial_path = Path.home() / 'Downloads'
@@ -274,69 +317,114 @@ class PlotGUI(ctk.CTk):
                                                     filetypes=[("Pickle files", "*.pkl")],
                                                     initialdir=f'{initial_path}')
 
-        self.destroy_checkboxes()
+        self.clear_checklists()
 
         if self.slide_visible:  # should be True
             self.parameter_frame.tkraise()
 
-        if self.file_path:
-            self.file_button.configure(text='File selected', fg_color='gray30')
+        self.store = None
+        self.refit_engine = None
 
-            self.df = pd.read_pickle(self.file_path)
-            self.df_drugs = self.df['Drug'].unique()
-            self.df_singles = [d for d in self.df_drugs if '+' not in d]
-            self.df_combos = [d for d in self.df_drugs if '+' in d]
-            self.df_strains = self.df['Strain'].unique()
-            self.df_timepoints = self.df['Timepoint'].unique()
+        if self.file_path:
+            self.file_button.configure(text='Loading file...', fg_color='gray30')
+            self.file_loader.load(self.file_path)
+            self.ms_journal = SelectionJournal(self.file_path)
+            self.selection_history = self.selection_histories.setdefault(self.file_path, SelectionHistory())
+            self.set_loading(True)
 
-            self.generate_checkbox_scrollables()
+            if not self.load_poll_id:
+                self.load_poll_id = self.after(50, self.poll_loader)
 
         else:
-            pass
+            self.file_loader.cancel()
+            self.set_loading(False)
 
         return
 
-    def generate_checkbox_scrollables(self):
-        """Initializes parameters, as checkboxes, inside the scrollable frames for drugs, strains, and timepoints
-         in order to allow the user to display and filter specific data. The current state of these checkboxes is
-         stored as boolean variables within the self.checkboxes dict().
+    def poll_loader(self):
+        """Recursive self.after() call that collects the stages of the file that self.file_loader is loading. Checkboxes
+        are generated as soon as the keys are read, plots and exports wait for the ResultStore."""
 
-        Format of self.checkboxes.items():
-        key, (index, ParameterCheckbox)
-        """
+        self.load_poll_id = None
 
-        frames = [self.drugs_scrollable, self.strains_scrollable, self.timepoints_scrollable]
-        self.checkboxes = dict()
-        self.idx1_map = {0: 'drugs', 1: 'strains', 2: 'timepoints'}
+        for load_id, stage, payload in self.file_loader.poll():
+            if load_id != self.file_loader.load_id:  # a file that was since replaced by another
+                continue
 
-        self.checkboxes['all_singles'] = ParameterCheckbox(master=frames[0], row=0, text='1-way')
-        self.checkboxes['all_combos'] = ParameterCheckbox(master=frames[0], row=1, text='2-way')
+            match stage:
+                case 'keys':
+                    self.df, keys, self.key_dtypes = payload
+                    self.df_drugs = keys['Drug']
+                    self.drug_index = DrugIndex(self.df_drugs)  # single drug -> combos containing it
+                    self.df_singles = self.drug_index.singles
+                    self.df_combos = self.drug_index.combos
+                    self.df_strains = keys['Strain']
+                    self.df_timepoints = keys['Timepoint']
 
-        # Checkboxes for all drugs (singles and combinations), strains, and timepoints
-        for idx1, parameter in enumerate([self.df_drugs, self.df_strains, self.df_timepoints]):
-            key = self.idx1_map[idx1]
-            offset = 2 if idx1 == 0 else 0
+                    self.populate_checklists()
+                    self.file_button.configure(text='Indexing fits...')
 
-            self.checkboxes.update({key: []})
+                case 'store':
+                    self.store = payload  # (drug, strain, timepoint) -> row positions
+                    self.refit_engine = RefitEngine(self.store)
+                    self.file_button.configure(text='File selected')
+                    self.set_loading(False)
 
-            for idx2, p in enumerate(parameter, start=offset):
-                checkbox = ParameterCheckbox(master=frames[idx1], row=idx2, text=str(p))
+                case 'error':
+                    self.clear_checklists()
+                    self.file_button.configure(text='Select file', fg_color='gray')
+                    self.set_loading(False)
+                    LabelToplevel(master=self, title='Error', text='File could not be loaded')
 
-                self.checkboxes[key].append(((idx2 - offset), checkbox))
+        if self.loading:
+            self.load_poll_id = self.after(50, self.poll_loader)
+
+        return
+
+    def set_loading(self, loading: bool):
+        """Runs the progress bar as an indeterminate indicator while a file loads."""
+
+        if loading and not self.loading:
+            self.progress_bar.configure(mode='indeterminate')
+            self.progress_bar.start()
+
+        elif not loading and self.loading:
+            self.progress_bar.stop()
+            self.progress_bar.configure(mode='determinate')
+            self.progress_bar.set(0)
+
+        self.loading = loading
+
+        return
+
+    def populate_checklists(self):
+        """Fills the checkbox lists for drugs, strains, and timepoints in order to allow the user to display and filter
+        specific data. The lists only hold strings and a selection array (see CheckList), so they are re-used for every
+        file instead of creating a checkbox per item.
+
+        Format of self.checklists['drugs'].items:
+        ['1-way', '2-way', *self.df_drugs] (the selected() indices of every list index self.df_drugs etc.)
+        """
+
+        self.checklists['drugs'].set_items(['1-way', '2-way'] + list(self.df_drugs))
+        self.checklists['strains'].set_items(self.df_strains)
+        self.checklists['timepoints'].set_items(self.df_timepoints)
 
         return
 
     def get_user_inputs(self):
         """Retrieves selected user inputs for drugs, strains, and timepoints and uses them to filter data.
-        These selections are boolean variables contained within the self.checkboxes dict(). Initiates/updates class
+        These selections are the boolean selection arrays of self.checklists. Initiates/updates class
         attributes self.f_drugs, self.f_strains, and self.f_timepoints.
+
+        2-way together with individual drugs selects all combos containing any of those drugs (e.g. 2-way + BDQ -> all
+        BDQ combos), see DrugIndex.
         """
 
         self.f_drugs = self.f_strains = self.f_timepoints = None
 
-        if hasattr(self, 'checkboxes'):
-            singles_clicked = self.checkboxes['all_singles'].get()
-            combos_clicked = self.checkboxes['all_combos'].get()
+        if self.checklists['drugs'].items:
+            singles_clicked, combos_clicked = self.checklists['drugs'].selection[:2]
             filter_list = lambda a, b: list(np.array(a)[b])  # returns list of a which satisfies b
 
             # If both, 1-way, or 2-way selected
@@ -345,15 +433,24 @@ class PlotGUI(ctk.CTk):
             elif singles_clicked:
                 f_drugs = self.df_singles
             elif combos_clicked:
-                f_drugs = self.df_combos
+                drug_indices = self.checklists['drugs'].selected()
+
+                # Checked combos are kept as they are, checked singles expand to every combo containing them
+                if len(drug_indices):
+                    checked = filter_list(self.df_drugs, drug_indices)
+                    combos = set(self.drug_index.combos_containing(checked))
+                    combos.update(drug for drug in checked if self.drug_index.any_combo([drug]))
+                    f_drugs = [drug for drug in self.df_combos if drug in combos]  # in name order
+                else:
+                    f_drugs = self.df_combos
 
             # Individual drug selections
             else:
-                drug_indices = [x[0] for x in self.checkboxes['drugs'] if x[1].get() is True]
+                drug_indices = self.checklists['drugs'].selected()
                 f_drugs = filter_list(self.df_drugs, drug_indices)
 
-            strain_indices = [y[0] for y in self.checkboxes['strains'] if y[1].get() is True]
-            timepoint_indices = [z[0] for z in self.checkboxes['timepoints'] if z[1].get() is True]
+            strain_indices = self.checklists['strains'].selected()
+            timepoint_indices = self.checklists['timepoints'].selected()
 
             f_strains = filter_list(self.df_strains, strain_indices)
             f_timepoints = filter_list(self.df_timepoints, timepoint_indices)
@@ -370,18 +467,27 @@ class PlotGUI(ctk.CTk):
         specifies to the user of certain, illegitimate selection of parameters."""
 
         command = self.dropdown_var.get()
+
+        if self.loading:
+            LabelToplevel(master=self, title='Loading', text='Please wait until\n the file is loaded')
+            return
+
+        if command == 'Write MS to pickle':  # no selection needed
+            self.write_manual_selection()
+            return
+
         self.get_user_inputs()
 
         if all([self.f_drugs, self.f_strains, self.f_timepoints]):
             match command:
                 case 'Dose response' | 'Growth rate':
-                    self.destroy_display_frames()
+                    self.clear_display_frames()
                     self.get_user_inputs()
 
                     # Initialize or re-bind controls (disconnected for proper destruction)
-                    self.bind('<Left>', lambda event: self.next_frame('L'))
-                    self.bind('<Right>', lambda event: self.next_frame('R'))
-                    self.bind('<Down>', lambda event: self.setup_default_state())
+                    self.bind('<Left>', self.key_binding(lambda: self.next_frame('L')))
+                    self.bind('<Right>', self.key_binding(lambda: self.next_frame('R')))
+                    self.bind('<Down>', self.key_binding(self.setup_default_state))
 
                     self.initialize_display_frames()
 
@@ -392,10 +498,10 @@ class PlotGUI(ctk.CTk):
                     PDFToplevel(master=self,title='Save to PDF', callback=self.receive_PDF_callback,
                                 restrictions = can_superimpose)
 
-                case 'Manual select.':
+                case 'Manual selection':
                     self.get_user_inputs()
 
-                    if any(True if '+' in d else False for d in self.f_drugs):
+                    if self.drug_index.any_combo(self.f_drugs):
                         LabelToplevel(master=self, title='Error',
                                       text='Please select 1-way combinations\n for manual selection')
                     elif len(self.f_strains) > 1 or len(self.f_timepoints) > 1:
@@ -417,7 +523,6 @@ class PlotGUI(ctk.CTk):
         self.progress_bar.set(0)
         self.progress_bar.update_idletasks()
         self.current_frame_idx = 0
-        self.display_frames = dict()
 
         # One drug, one plot
         if len(self.f_drugs) == 1:
@@ -441,26 +546,21 @@ class PlotGUI(ctk.CTk):
         # Each subplot is a unique drug. Strains, timepoints, and replicates are all superimposed.
         self.construct_frames(batch_size, num_plots, nrows, ncols)
 
-        initial_display = self.display_frames[self.current_frame_idx]
-        initial_display.toggle_event_listeners(state=True)
-        initial_display.tkraise()
-        self.subplot_count_sbutton.tkraise()
-        self.partition_plot_switch.tkraise()
-        self.pf_button.tkraise()
-
-        if self.slide_visible:
-            self.parameter_frame.tkraise()
+        frame = self.get_pool_frame(num_plots, nrows, ncols)
+        frame.ms_allowed = not self.drug_index.any_combo(self.f_drugs)  # manual selection is only used for singles
+        frame.history = self.selection_history  # replicate selections survive re-plotting
+        frame.refit = self.refit_curves
 
-        self.after(50)
+        self.show_frame(self.current_frame_idx)
 
         return
 
     def construct_frames(self, batch_size, num_plots, nrows, ncols):
-        """Superimposed (default) or partitioned plots are batched to frames."""
+        """Superimposed (default) or partitioned plots are batched to frames. Frames themselves are only built once
+        they are reached (see self.show_frame), so the time to the first plot does not depend on the selection size."""
 
-        # Improve indexing efficiency by subsetting self.df (even though plot() method handles this)
-        df = self.df[self.df['Timepoint'].isin(self.f_timepoints) & (self.df['Strain'].isin(self.f_strains)) &
-                     (self.df['Drug'].isin(self.f_drugs))]
+        # Subset of self.df for the current selection using the (drug, strain, timepoint) index
+        df = self.store.rows(self.f_drugs, self.f_strains, self.f_timepoints)
         gr = True if self.dropdown_var.get() == 'Growth rate' else False
         partition = self.partition_plot_switch.get()
 
@@ -470,57 +570,193 @@ class PlotGUI(ctk.CTk):
         else:
             batches = [self.f_drugs[i:i + batch_size] for i in range(0, len(self.f_drugs), batch_size)]
 
-        # Construction of self.display_frames according to user specifications
-        for i_frame, batch in enumerate(batches):  # each batch is a subplot and a frame
-            fig, axs = plt.subplots(nrows=nrows, ncols=ncols, dpi=95)
+        # Everything self.frame_builder needs in order to construct any frame later on (the selection is copied, so
+        # later calls to self.get_user_inputs() do not change frames that are not built yet)
+        self.frame_specs = {'drugs': list(self.f_drugs), 'strains': list(self.f_strains),
+                            'timepoints': list(self.f_timepoints), 'gr': gr, 'partition': partition,
+                            'batches': batches, 'num_plots': num_plots, 'nrows': nrows, 'ncols': ncols}
+        self.num_frames = len(batches)
 
-            subplot_rep_locs = {}
-            main_text = r"$\bf{Growth\ rate\ inhibitions}$" if gr else r"$\bf{Dose\ response}$"
+        return
 
-            plt.suptitle(
-                f'{main_text}\n{" \u2022 ".join(self.f_strains) if self.f_strains != ["EL"] else "Erdman-Lux"}'
-                f', {" \u2022 ".join(self.f_timepoints)}',
-                fontname='Arial', fontsize=14, fontstyle='oblique')
+    def frame_builder(self, i_frame):
+        """Returns a callable that computes the content of batch i_frame of self.frame_specs, swaps it into a pooled
+        matplotlib Figure (see self.populate_frame) and returns the content. It runs on the self.frame_renderer worker
+        thread, so it only uses values that are captured here and never touches Tk or pyplot.
 
-            if isinstance(axs, np.ndarray):  # checks for existence of subplot
-                flattened_axs = axs.flatten()
-            else:
-                flattened_axs = axs
-            flattened_axs = axs.flatten() if isinstance(axs, np.ndarray) else axs
+        Format of content:
+        {'suptitle': str, 'num_plots': int, 'subplots': [plot_elements() dict per subplot], 'rep_locs': [list per subplot]}
+        """
 
-            for i_element, element in enumerate(batch): # an element is either a drug:str or a pandas.Index for a the .loc of a row
-                subplot_axs = flattened_axs[i_element]
+        specs = self.frame_specs
+        gr, partition, num_plots = specs['gr'], specs['partition'], specs['num_plots']
+        batch = specs['batches'][i_frame]  # each batch is a subplot and a frame
+        f_strains, f_timepoints, store = specs['strains'], specs['timepoints'], self.store
+        populate_frame = self.populate_frame
 
-                # Plot and retrieve integer-label (.loc) of replicates
+        def build(fig):
+            main_text = r"$\bf{Growth\ rate\ inhibitions}$" if gr else r"$\bf{Dose\ response}$"
+            suptitle = (f'{main_text}\n{" \u2022 ".join(f_strains) if f_strains != ["EL"] else "Erdman-Lux"}'
+                        f', {" \u2022 ".join(f_timepoints)}')
+
+            subplots, rep_locs = list(), list()
+
+            for element in batch: # an element is either a drug:str or a pandas.Index for a the .loc of a row
+                # Plot elements and integer-label (.loc) of replicates
                 if partition:
-                    row = df.loc[element]
-                    drug = row['Drug']
-                    strain = row['Strain']
-                    timepoint = row['Timepoint']
+                    position = store.positions_of([element])[0]
+                    drug, strain, timepoint = (store.keys[column][position] for column in store.key_columns)
 
-                    rep_locs = plot(df, subplot_axs, drug, strains=[strain], timepoints=[timepoint], row_indices=[element],
-                                    subplot=i_element, save_type='pdf', gr=gr)
+                    elements = plot_elements(store, drug, strains=[strain], timepoints=[timepoint],
+                                             row_indices=[element], save_type='pdf', gr=gr)
 
                 else:
-                    rep_locs = plot(df, subplot_axs, strains=self.f_strains, drug=element, timepoints=self.f_timepoints,
-                                    subplot=i_element, save_type='pdf', gr=gr)
+                    elements = plot_elements(store, element, strains=f_strains, timepoints=f_timepoints,
+                                             save_type='pdf', gr=gr)
 
-                # Subplot specifications depending on plots per frame
-                self.plot_specifications(subplot_axs, num_plots)
+                subplots.append(elements)
+                rep_locs.append(elements['rep_locs'] if elements else list())
 
-                # Store in a dictionary that maps it to the respective axs obj
-                subplot_rep_locs.update({subplot_axs: rep_locs})
+            content = {'suptitle': suptitle, 'num_plots': num_plots, 'subplots': subplots, 'rep_locs': rep_locs}
+            populate_frame(fig, content)
 
-            self.update_progress(len(batches))
+            return content
 
-            plt.subplots_adjust(hspace=0.4, wspace=0.3)
-            frame = PlotFrame(master=self, fig=fig, subplot_rep_locs=subplot_rep_locs)
+        return build
 
-            if (has_combo := any('+' in d for d in self.f_drugs)):  # manual selection is only used for singles
-                frame.ms_condition = False
+    def populate_frame(self, fig, content):
+        """Swaps the content of a display frame (from self.frame_builder) into the existing axes of a pooled figure.
+        Called on the worker thread for the offscreen render and on the Tk thread by PlotFrame.load_frame, so both
+        figures end up in the same state."""
 
-            plt.close(fig)
-            self.display_frames.update({i_frame: frame})
+        fig.suptitle(content['suptitle'], fontname='Arial', fontsize=14, fontstyle='oblique')
+
+        for i_subplot, axs in enumerate(fig.get_axes()):
+            axs.set_facecolor(matplotlib.rcParams['axes.facecolor'])  # clears manual selection highlights
+            elements = content['subplots'][i_subplot] if i_subplot < len(content['subplots']) else None
+            draw_elements(axs, elements, reuse=True)
+
+            # Subplot specifications depending on plots per frame
+            if elements:
+                self.plot_specifications(axs, content['num_plots'])
+            else:
+                axs.tick_params(labelsize='medium')
+
+        return
+
+    def request_frame(self, i_frame, priority: int = 0):
+        """Submits frame i_frame to self.frame_renderer unless it is already rendered or on its way."""
+
+        if i_frame in self.raster_cache or i_frame in self.pending_frames:
+            return
+
+        self.pending_frames.add(i_frame)
+        self.frame_renderer.submit(key=(self.render_generation, i_frame), build=self.frame_builder(i_frame),
+                                   size=self.temp_canvas.get_width_height(physical=True), dpi=95,
+                                   layout=(self.frame_specs['nrows'], self.frame_specs['ncols']), priority=priority)
+
+        if not self.poll_id:
+            self.poll_id = self.after(15, self.poll_renderer)
+
+        return
+
+    def poll_renderer(self):
+        """Recursive self.after() call that collects frames finished by self.frame_renderer while any are pending. A
+        frame that failed to render is reported if the user is waiting on it and is requested again when it is reached."""
+
+        self.poll_id = None
+
+        for (generation, i_frame), result, error in self.frame_renderer.poll():
+            if generation != self.render_generation:  # rendered for display frames that were since cleared
+                continue
+
+            self.pending_frames.discard(i_frame)
+
+            if result:
+                renderer, content = result
+                self.attach_frame(i_frame, content, renderer)
+
+            elif error is not None and i_frame == self.current_frame_idx:  # the frame the user is waiting on
+                LabelToplevel(master=self, title='Error', text=f'Frame {i_frame + 1} could not be plotted\n'
+                                                               f'({type(error).__name__})')
+
+        if self.pending_frames:
+            self.poll_id = self.after(15, self.poll_renderer)
+
+        return
+
+    def attach_frame(self, i_frame, content, renderer):
+        """Caches a frame rendered offscreen and shows it if it is the frame that the user is waiting on."""
+
+        self.raster_cache.put(i_frame, content, renderer)
+        self.rendered_frames.add(i_frame)
+        self.update_progress(self.num_frames)
+
+        if i_frame == self.current_frame_idx:
+            self.show_frame(i_frame)
+
+        return
+
+    def get_pool_frame(self, num_plots, nrows, ncols):
+        """PlotFrame of self.frame_pool for the layout, created the first time that the layout is used."""
+
+        if num_plots not in self.frame_pool:
+            fig = frame_figure(self.temp_canvas.get_width_height(physical=True), dpi=95, nrows=nrows, ncols=ncols)
+            self.frame_pool[num_plots] = PlotFrame(master=self, fig=fig, populate=self.populate_frame)
+
+        return self.frame_pool[num_plots]
+
+    def show_frame(self, i_frame):
+        """Loads frame i_frame from self.raster_cache into the pooled PlotFrame of the current layout and brings it into
+        the foreground with its event listeners. If it has not been rendered yet (or was evicted), it is requested and
+        shown by self.attach_frame once it arrives. Previous and next frames are prefetched."""
+
+        self.current_frame_idx = i_frame
+
+        if i_frame in self.raster_cache:
+            content, renderer = self.raster_cache.get(i_frame)
+            frame = self.frame_pool[self.frame_specs['num_plots']]
+
+            frame.toggle_event_listeners(state=False)
+            frame.load_frame(i_frame, content, renderer)
+            frame.toggle_event_listeners(state=True)
+
+            frame.tkraise()
+            self.subplot_count_sbutton.tkraise()
+            self.partition_plot_switch.tkraise()
+            self.pf_button.tkraise()
+
+            if self.slide_visible:
+                self.parameter_frame.tkraise()
+
+        else:
+            self.request_frame(i_frame, priority=0)
+
+        self.prefetch_frames()
+
+        return
+
+    def prefetch_frames(self):
+        """Requests the previous and next frames (relative to self.current_frame_idx) so that navigating with L/R
+        arrows does not wait on rendering."""
+
+        for step in (1, -1):
+            self.request_frame((self.current_frame_idx + step) % self.num_frames, priority=1)
+
+        return
+
+    def cancel_rendering(self):
+        """Drops queued renders and stops polling (e.g. when the display frames are cleared). Renders that are
+        already running are discarded by self.poll_renderer."""
+
+        self.render_generation += 1
+        self.frame_renderer.clear()
+        self.pending_frames.clear()
+        self.rendered_frames.clear()
+
+        if self.poll_id:
+            self.after_cancel(self.poll_id)
+            self.poll_id = None
 
         return
 
@@ -534,17 +770,13 @@ class PlotGUI(ctk.CTk):
                 axs.title.set_fontsize(11)
                 axs.xaxis.label.set_fontsize(8)
                 axs.yaxis.label.set_fontsize(8)
-
-                for label in (axs.get_xticklabels() + axs.get_yticklabels()):
-                    label.set_fontsize(8)
+                axs.tick_params(labelsize=8)  # also applies to ticks created later on (pooled axes)
             case 16:
                 axs.title.set_fontsize(9)
                 axs.xaxis.label.set_visible(False)
                 axs.yaxis.label.set_visible(False)
                 axs.legend(frameon=False, fontsize=10)
-
-                for label in (axs.get_xticklabels() + axs.get_yticklabels()):
-                    label.set_fontsize(6)
+                axs.tick_params(labelsize=6)
 
         return
     def prerun_specifications(self):
@@ -560,127 +792,175 @@ class PlotGUI(ctk.CTk):
         else:
             groupings = [x for x in groupings if x!= 'None']
 
-        self.save_selections(groupings, gr, partition, batch_size)
+        self.save_selections(groupings, gr, partition, batch_size, callback_dict['raster_dpi'])
 
         return
 
-    def save_selections(self, groupings, gr, partition, batch_size):
-        """Currently selected checkboxes are used in order to generate a PDF in which each page is a 1x3 subplot
+    def save_selections(self, groupings, gr, partition, batch_size, raster_dpi=None):
+        """Currently selected checkboxes are used in order to generate a PDF in which each page is a 1x3 subplot.
+        The export is queued as a background job (see self.export_queue) whose progress is shown in
+        self.export_toplevel, so plots can still be browsed in the meantime. A finished PDF export shows its file size
+        and render time per page (see helper.PageStats).
+
+        :param raster_dpi: compact PDF, curves and scatters are rasterized at this dpi (None: vectors only)
         """
 
         save_path = Path.home() / 'Downloads'
-        df = self.df[(self.df['Drug'].isin(self.f_drugs)) & (self.df['Strain'].isin(self.f_strains))
-                     & (self.df['Timepoint'].isin(self.f_timepoints))]
+        df = self.store.rows(self.f_drugs, self.f_strains, self.f_timepoints)
         df = df.sort_values(groupings)
         save_map = {'Save to PDF': 'pdf', 'Save to PNGs': 'png'}
+        save_type = save_map[self.dropdown_var.get()]
+        drugs, strains, timepoints, store = list(self.f_drugs), list(self.f_strains), list(self.f_timepoints), self.store
+        page_stats = PageStats()
+
+        def run(progress, cancelled):
+            completed = generate_plot_images(df, drugs=drugs, strains=strains, timepoints=timepoints,
+                                             save_path=save_path, save_type=save_type, batch_size=batch_size, gr=gr,
+                                             partition=partition, store=store, workers=os.cpu_count() or 1,
+                                             progress=progress, cancelled=cancelled, raster_dpi=raster_dpi,
+                                             page_stats=page_stats)
+            job.detail = page_stats.summary()
+
+            return completed
+
+        name = f'{save_type.upper()} \u2022 {", ".join(strains)} \u2022 {len(df)} rows'
+        name += f' \u2022 compact ({raster_dpi} dpi)' if save_type == 'pdf' and raster_dpi else ''
+        job = ExportJob(name=name, run=run)  # assigned before it is submitted, run() sets its detail
+        self.export_queue.submit(job)
+        self.export_jobs.append(job)
+
+        if self.export_toplevel is None or not self.export_toplevel.winfo_exists():
+            self.export_toplevel = ExportToplevel(master=self, title='Exports (saved in Downloads)')
 
-        generate_plot_images(df, drugs=self.f_drugs, strains=self.f_strains, timepoints=self.f_timepoints,
-                             save_path=save_path, save_type=save_map[self.dropdown_var.get()], batch_size=batch_size,
-                             gr=gr, partition=partition)
+        self.export_toplevel.add_job(job)
 
-        LabelToplevel(master=self, title='Success', text='Selected plots saved in Downloads')
-        self.after(50)
+        if not self.export_poll_id:
+            self.export_poll_id = self.after(100, self.poll_exports)
+
+        return
+
+    def poll_exports(self):
+        """Recursive self.after() call that refreshes self.export_toplevel while any export job is unfinished."""
+
+        self.export_poll_id = None
+
+        # Unfinished jobs are collected before the refresh, so a job that finishes in between is shown once more
+        self.export_jobs = [job for job in self.export_jobs if not job.finished]
+
+        if self.export_toplevel is not None and self.export_toplevel.winfo_exists():
+            self.export_toplevel.refresh()
+
+        if self.export_jobs:
+            self.export_poll_id = self.after(100, self.poll_exports)
 
         return
 
     def manual_selection(self):
         """Method that contains Manual Selection logic e.g. if 2/3 reps selected for a single -> remove all associated combos.
-        Uses selected replicates and then creates an MS_Flag column."""
+        Uses selected replicates and then records the rows to flag (MS_Flag) in self.ms_journal. The pickle itself is
+        only rewritten by self.write_manual_selection()."""
 
         # if 2/3 reps selected for a single -> remove all associated combos
-        all_reps_to_remove = set()
+        all_reps_to_remove = self.selection_history.reps_to_remove()  # over every subplot of the file
         row_integer_labels, drugs = set(), set()
 
-        for frame in self.display_frames.values():
-            if hasattr(frame, 'reps_to_remove'):
-                all_reps_to_remove = all_reps_to_remove | frame.reps_to_remove  # union of sets
-
         if all_reps_to_remove:
             for arg in all_reps_to_remove:
                 (row_integer_labels if type(arg) == int else drugs).add(arg)
 
-            # Single strain, single timepoint for MS
-            condition1 = self.df['Strain'].isin(self.f_strains)
-            condition2 = self.df['Timepoint'].isin(self.f_timepoints)
+            # Selected replicates are looked up with the row index (their labels belong to a single strain and
+            # timepoint, also when they were selected on an earlier plot)
+            condition3 = np.zeros(len(self.store.df), dtype=bool)
+            condition3[self.store.positions_of(row_integer_labels)] = True  # replicates
 
-            # Handles filtering replicates or all combinations containing a certain drug
-            empty = pd.Series(False, index=self.df.index)
-            condition3 = self.df.index.isin(row_integer_labels) if row_integer_labels else empty # replicates
-            condition4 = self.df['Drug'].str.contains('|'.join(drugs)) if drugs else empty # single and combos containing drug(s)
+            # Handles filtering all combinations containing a certain drug (inverted index of combination components)
+            condition4 = np.zeros(len(self.store.df), dtype=bool)
+            condition4[self.store.containing(drugs)] = True  # single and combos containing drug(s)
 
-            self.df['MS_Flag'] = np.nan
-            mask = (condition1 & condition2) & condition3 | condition4  # condition3 or condition4 for single strain and timepoint
-            self.df.loc[mask, 'MS_Flag'] = int(1)
-            self.df.to_pickle(self.file_path)
+            mask = condition3 | condition4  # condition3 or condition4 for single strain and timepoint
+            self.ms_journal.record(self.store.labels(np.flatnonzero(mask)))
 
             LabelToplevel(master=self, title='Success', text='Manual selection was done\n on the selected replicates')
-            print(all_reps_to_remove)
-            print(self.df['MS_Flag'].value_counts()[1])
 
         else:
             LabelToplevel(master=self, title='Error', text='Please select replicate(s)\n for removal')
 
         return
 
+    def write_manual_selection(self):
+        """Folds self.ms_journal into the MS_Flag column of the pickle (see SelectionJournal.compact())."""
+
+        if self.ms_journal is None or not self.ms_journal.entries:
+            LabelToplevel(master=self, title='Error', text='There are no manual selections\n to write')
+            return
+
+        # The loaded DataFrame is only written back if it is complete (a file opened from its cache is read again)
+        df = None if self.key_dtypes is None else restore_keys(self.df, self.key_dtypes)
+        self.ms_journal.compact(df)
+
+        LabelToplevel(master=self, title='Success', text='Manual selection was written\n to the pickle')
+
+        return
+
+    def refit_curves(self, keys) -> dict:
+        """Re-fits the subplots with keys (SelectionHistory keys) on their remaining replicates, in one batch (see
+        RefitEngine), with the model of the current plots (Hill or GR Hill). Returns {key: (x, y, legend label)} for
+        PlotFrame, EC50 and Einf of every re-fit are shown in the legend."""
+
+        selections = {key: self.selection_history.get(key) for key in keys}
+        refits = self.refit_engine.refit(selections, gr=self.frame_specs['gr'])
+
+        return {key: (refit['x'], refit['y'], f'Re-fit: EC50 {refit['EC50']:.3g}, Einf {refit['Einf']:.2f}')
+                for key, refit in refits.items()}
+
+    def step_selection_history(self, redo: bool = False):
+        """Undoes (Ctrl+Z) or redoes (Ctrl+Y, Ctrl+Shift+Z) the last change of a replicate selection. Only the
+        highlight of the changed subplot is updated, if it is on a display frame that is loaded."""
+
+        if self.selection_history is None:
+            return
+
+        key = self.selection_history.redo() if redo else self.selection_history.undo()
+
+        if key is not None:
+            for frame in self.frame_pool.values():
+                frame.refresh_selections(key)
+
+        return
+
     def next_frame(self, direction: str = 'R'):
-        """After self.generate_plot(), lifts leftward or rightward frame in self.display_frames while handling
-         event_listeners.
+        """After self.generate_plot(), loads the leftward or rightward frame into the pooled PlotFrame (event listeners
+        are handled by self.show_frame).
         """
 
         dir_var = 1 if direction == 'R' else -1
 
-        if hasattr(self, 'display_frames'):
-            # Prepare for background
-            current_frame = self.display_frames[self.current_frame_idx]
-            current_frame.toggle_event_listeners(state=False)
-
+        if hasattr(self, 'frame_specs'):
             # Adjust variables and bring new frame into foreground
-            self.current_frame_idx = (self.current_frame_idx + dir_var) % len(
-                self.display_frames)  # update to next frame
-            next_frame = self.display_frames[self.current_frame_idx]
-            next_frame.toggle_event_listeners(state=True)
-
-            next_frame.tkraise()
-            self.subplot_count_sbutton.tkraise()
-            self.partition_plot_switch.tkraise()
-            self.pf_button.tkraise()
-
-            if self.slide_visible:
-                self.parameter_frame.tkraise()
+            self.show_frame((self.current_frame_idx + dir_var) % self.num_frames)  # update to next frame
 
         return
 
-    def destroy_display_frames(self):
-        """Full destroy of PlotFrame objects (and any references) within self.display_frames dict() as well as
-        MSTopLevel which is mastered by PlotFrame."""
+    def clear_display_frames(self):
+        """Resets the pooled PlotFrame objects within self.frame_pool (including MSTopLevel which is mastered by
+        PlotFrame) and drops rendered frames. Figures and canvases are kept, so memory stays flat across runs."""
 
-        # Help release PlotFrame objects by unbinding events
         self.unbind('<Left>')
         self.unbind('<Right>')
         self.unbind('<Down>')
+        self.cancel_rendering()
+        self.raster_cache.clear()
 
-        if hasattr(self, 'display_frames'):
-            for frame in self.display_frames.values():
-                frame.destroy()
-            self.display_frames.clear()
-            gc.collect()  # Force garbage collection on lingering objects
+        for frame in self.frame_pool.values():
+            frame.reset()
 
         return
 
-    def destroy_checkboxes(self):
-        """Destroys checkboxes and gets rid of any references."""
-
-        if hasattr(self, 'checkboxes'):  # destroy checkboxes
-            for val in self.checkboxes.values():
-                if isinstance(val, list):
-                    for tupl in val:
-                        cb = tupl[1]
-                        cb.destroy()
-
-                        for attr in list(cb.__dict__.keys()):
-                            setattr(cb, attr, None)
+    def clear_checklists(self):
+        """Empties the checkbox lists (e.g. while another file is loaded)."""
 
-            self.checkboxes.clear()
+        for checklist in self.checklists.values():
+            checklist.set_items([])
 
         return
 
@@ -0,0 +1,193 @@
+# refit.py
+# Name: Hidetomi Nitta
+# Purpose: Batched re-fitting of Hill (or GR Hill) curves on the replicates that remain after manual selection
+
+import numpy as np
+from fit import Fit
+from helper import dose_grid, evaluate_curves
+from result_store import ResultStore
+
+
+def fit_curves(xs: list, ys: list, initial: np.ndarray, gr: bool = False, max_iter: int = 100,
+               tol: float = 1e-10) -> dict:
+    """Least-squares fits of Fit().Hill (or Fit().GR_Hill) to many curves at once with a vectorized Levenberg-Marquardt:
+    every curve is padded to the same number of points, so each iteration evaluates the model for all curves in a
+    few broadcast calls (Jacobians by central differences, so any Fit model can be used). EC50 is fitted as log10(EC50).
+
+    Keyword arguments:
+    :param xs: list of dose arrays (nL), one per curve
+    :param ys: list of response arrays aligned with xs
+    :param initial: (n_curves, 3) array of initial Einf, EC50, and Hill slope
+    :param gr: fit Fit().GR_Hill instead of Fit().Hill
+    :param max_iter: maximum number of iterations
+    :param tol: relative decrease of the squared error below which a curve has converged
+
+    Returns {'Einf': np.ndarray, 'EC50': ..., 'Hill Slope': ..., 'R_squared': ...} with one entry per curve (NaN for
+    curves with fewer than 4 points or no finite fit).
+    """
+
+    f = Fit()
+    model = f.GR_Hill if gr else f.Hill
+
+    n_curves, n_points = len(xs), max((len(x) for x in xs), default=0)
+    X = np.ones((n_curves, n_points))  # padding is a valid dose with zero weight
+    Y = np.zeros((n_curves, n_points))
+    W = np.zeros((n_curves, n_points), dtype=bool)
+
+    for i, (x, y) in enumerate(zip(xs, ys)):
+        X[i, :len(x)], Y[i, :len(y)], W[i, :len(x)] = x, y, True
+
+    def residuals(p):
+        with np.errstate(all='ignore'):
+            y_pred = model(X, p[:, 0:1], 10 ** p[:, 1:2], p[:, 2:3])
+
+        return np.where(W, y_pred - Y, 0.0)
+
+    params = np.column_stack([initial[:, 0], np.log10(initial[:, 1]), initial[:, 2]])
+    r = residuals(params)
+    cost = (r ** 2).sum(axis=1)
+    damping = np.full(n_curves, 1e-3)
+    active = np.isfinite(cost) & (W.sum(axis=1) >= 4)
+
+    for _ in range(max_iter):
+        if not active.any():
+            break
+
+        J = np.empty((n_curves, n_points, 3))
+
+        for k in range(3):
+            step = np.zeros_like(params)
+            step[:, k] = 1e-6 * np.maximum(1.0, np.abs(params[:, k]))
+            J[:, :, k] = (residuals(params + step) - residuals(params - step)) / (2 * step[:, k:k + 1])
+
+        JTJ = np.einsum('nmi,nmj->nij', J, J)
+        JTr = np.einsum('nmi,nm->ni', J, r)
+        A = JTJ + damping[:, None, None] * (JTJ * np.eye(3)) + 1e-12 * np.eye(3)
+
+        valid = active & np.isfinite(A).all(axis=(1, 2)) & np.isfinite(JTr).all(axis=1)
+        A[~valid], JTr[~valid] = np.eye(3), 0.0  # solved as a no-op
+
+        try:
+            delta = -np.linalg.solve(A, JTr[..., None])[..., 0]
+        except np.linalg.LinAlgError:  # a singular curve stops the whole batch
+            break
+
+        trial = params + delta
+        r_trial = residuals(trial)
+        cost_trial = (r_trial ** 2).sum(axis=1)
+
+        better = valid & np.isfinite(cost_trial) & (cost_trial < cost)
+        converged = better & ((cost - cost_trial) <= tol * np.maximum(cost, 1e-300))
+
+        params[better], r[better], cost[better] = trial[better], r_trial[better], cost_trial[better]
+        damping = np.where(better, damping / 10, damping * 10)
+        active &= valid & ~converged & (damping < 1e10)
+
+    y_mean = (Y * W).sum(axis=1) / np.maximum(W.sum(axis=1), 1)
+    total = (np.where(W, Y - y_mean[:, None], 0.0) ** 2).sum(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fits = {'Einf': params[:, 0], 'EC50': 10 ** params[:, 1], 'Hill Slope': params[:, 2],
+                'R_squared': 1 - cost / total}
+
+    failed = (W.sum(axis=1) < 4) | ~np.isfinite(params).all(axis=1) | ~np.isfinite(cost)
+
+    for values in fits.values():
+        values[failed] = np.nan
+
+    return fits
+
+
+class RefitEngine:
+    """Re-fits of subplots on the replicates that remain after manual selection. The doses and responses of the
+    remaining replicates of a subplot are pooled into one curve and every requested subplot is fitted in one
+    fit_curves() batch. Initial parameters are the mean of the remaining replicates' own fits.
+
+    Results are cached by (subplot key, selections, gr), so only subplots whose selections changed are fitted again."""
+
+    def __init__(self, store: ResultStore):
+        self.store = store
+        self.cache = dict()
+
+    def refit(self, selections: dict, gr: bool = False) -> dict:
+        """Re-fits of the subplots in selections ({SelectionHistory key: selections}). A subplot has a re-fit only if
+        one replicate was excluded (with 2 or more the single is removed as a whole) and any remain.
+
+        Format of the returned dict:
+        {key: {'x': log10 dose grid, 'y': fitted curve on it, 'Einf': float, 'EC50': ..., 'Hill Slope': ...,
+               'R_squared': ...}}
+        """
+
+        store = self.store
+        pending = list()
+
+        for key, selection in selections.items():
+            _, rep_locs = key
+
+            if (key, selection, gr) in self.cache or not selection or selection.count(True) != 1:
+                continue
+
+            remaining = [loc for loc, selected in zip(rep_locs, selection) if loc is not None and not selected]
+
+            if remaining:
+                pending.append((key, selection, store.positions_of(remaining)))
+
+        if pending:
+            responses = store.norm_gr if gr else store.growth_inhibitions
+            xs, ys, initial, grids = list(), list(), list(), list()
+
+            for _, _, positions in pending:
+                x, y = pooled_points(store, responses, positions)
+                xs.append(x)
+                ys.append(y)
+                grids.append(dose_grid([store.volumes[pos] for pos in positions]))
+                initial.append(initial_params(store.fits('gr' if gr else 'dr', positions), x, y))
+
+            fits = fit_curves(xs, ys, np.array(initial, dtype=float), gr=gr)
+
+            for i, (key, selection, _) in enumerate(pending):
+                params = {field: float(values[i]) for field, values in fits.items()}
+
+                if np.isnan(params['Einf']) or not grids[i].size:
+                    self.cache[(key, selection, gr)] = None
+                    continue
+
+                y_pred = evaluate_curves(grids[i], [params['Einf']], [params['EC50']], [params['Hill Slope']], gr=gr)[0]
+                self.cache[(key, selection, gr)] = {'x': np.log10(grids[i]), 'y': y_pred, **params}
+
+        results = {key: self.cache.get((key, selection, gr)) for key, selection in selections.items()}
+
+        return {key: result for key, result in results.items() if result is not None}
+
+
+def pooled_points(store: ResultStore, responses, positions) -> tuple:
+    """Doses and responses of the rows at positions as two flat arrays (only finite points with a positive dose)."""
+
+    xs, ys = list(), list()
+
+    for pos in positions:
+        x, y = store.volumes[pos], responses[pos]
+        n = min(len(x), len(y))
+        xs.append(x[:n])
+        ys.append(y[:n])
+
+    x, y = (np.concatenate(a) if a else np.empty(0) for a in (xs, ys))
+    keep = np.isfinite(x) & np.isfinite(y) & (x > 0)
+
+    return x[keep], y[keep]
+
+def initial_params(fits: dict, x: np.ndarray, y: np.ndarray) -> list:
+    """Einf, EC50, and Hill slope to start a pooled fit from: the mean of the replicates' fits (geometric mean for
+    EC50), or a guess from the data if none of them has a fit."""
+
+    finite_mean = lambda values: values[np.isfinite(values)].mean() if np.isfinite(values).any() else np.nan
+
+    einf, hill_slope = finite_mean(fits['Einf']), finite_mean(fits['Hill Slope'])
+    ec50 = 10 ** finite_mean(np.log10(fits['EC50'][fits['EC50'] > 0]))
+
+    if not np.isfinite([einf, ec50, hill_slope]).all() and x.size:
+        einf = y[x == x.max()].mean()
+        ec50 = 10 ** np.log10(x).mean()
+        hill_slope = 1.0
+
+    return [einf, ec50, hill_slope]
@@ -0,0 +1,155 @@
+# rendering.py
+# Name: Hidetomi Nitta
+# Purpose: Offscreen (Agg) rendering of PlotGUI frames on a worker thread
+
+import collections, itertools, queue, threading, traceback
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import RendererAgg
+
+
+def frame_figure(size: tuple, dpi: float, nrows: int, ncols: int) -> Figure:
+    """New Figure of size (width, height) in pixels with an nrows x ncols grid of axes, laid out like a display frame."""
+
+    width, height = size
+    fig = Figure(figsize=(width / dpi, height / dpi), dpi=dpi)
+    fig.subplots(nrows=nrows, ncols=ncols)
+    fig.subplots_adjust(hspace=0.4, wspace=0.3)
+
+    return fig
+
+
+class FrameRenderer:
+    """Worker thread that builds and draws frames offscreen so that the Tk thread stays responsive. A job is a callable
+    that populates a matplotlib Figure (never pyplot, which is not thread-safe) and returns a payload. The worker keeps
+    one figure per grid layout and re-uses it for every job, so jobs must swap their data into the existing axes.
+    Finished frames are put on self.results as (key, (renderer, payload), error) and are meant to be collected on the Tk
+    thread with self.poll(), e.g. from a recursive self.after() call, where the renderer's RGBA buffer is pasted onto a
+    canvas.
+
+    Jobs with a lower priority value are rendered first."""
+
+    def __init__(self):
+        self.jobs = queue.PriorityQueue()
+        self.results = queue.Queue()
+        self.counter = itertools.count()  # keeps jobs of equal priority in submission order
+        self.figures = dict()  # (size, dpi, nrows, ncols) -> Figure, only used by the worker thread
+
+        self.thread = threading.Thread(target=self.run, name='FrameRenderer', daemon=True)
+        self.thread.start()
+
+    def submit(self, key, build, size: tuple, dpi: float, layout: tuple, priority: int = 0):
+        """Queues build(fig) for offscreen rendering.
+
+        :param key: returned with the result to identify the frame
+        :param build: callable that draws on a Figure and returns a payload (runs on the worker thread)
+        :param size: (width, height) of the target canvas in pixels
+        :param dpi: dpi of the figure
+        :param layout: (nrows, ncols) of the figure's axes
+        :param priority: lower values are rendered first
+        """
+
+        self.jobs.put((priority, next(self.counter), key, build, (size, dpi, *layout)))
+
+        return
+
+    def clear(self):
+        """Drops every job that has not been started yet."""
+
+        while True:
+            try:
+                self.jobs.get_nowait()
+            except queue.Empty:
+                break
+
+        return
+
+    def poll(self) -> list:
+        """Finished jobs since the last call (non-blocking)."""
+
+        finished = list()
+
+        while True:
+            try:
+                finished.append(self.results.get_nowait())
+            except queue.Empty:
+                break
+
+        return finished
+
+    def run(self):
+        while True:
+            priority, _, key, build, figure_key = self.jobs.get()
+
+            try:
+                if figure_key not in self.figures:
+                    self.figures[figure_key] = frame_figure(*figure_key)
+
+                fig = self.figures[figure_key]
+                dpi = fig.dpi
+                payload = build(fig)
+
+                # Same rounding as FigureCanvasBase.get_width_height() so that the buffer matches the Tk canvas
+                width, height = (int(v) for v in fig.bbox.max)
+                renderer = RendererAgg(width, height, dpi)
+                fig.draw(renderer)
+
+            except Exception as e:
+                traceback.print_exc()
+                self.results.put((key, None, e))
+
+            else:
+                self.results.put((key, (renderer, payload), None))
+
+
+class RasterCache:
+    """LRU cache of frames rendered by FrameRenderer as key -> (payload, renderer). Bounded by the memory of the RGBA
+    buffers (budget in bytes): the least recently used frames are evicted once the budget is exceeded, but the most
+    recent frame is always kept."""
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.frames = collections.OrderedDict()
+        self.nbytes = 0
+
+    def __contains__(self, key):
+        return key in self.frames
+
+    def __len__(self):
+        return len(self.frames)
+
+    def get(self, key):
+        """(payload, renderer) of key, which becomes the most recently used frame. None if it is not cached."""
+
+        if key not in self.frames:
+            return None
+
+        self.frames.move_to_end(key)
+
+        return self.frames[key]
+
+    def put(self, key, payload, renderer):
+        """Caches a rendered frame as the most recently used one and evicts frames that exceed the budget."""
+
+        if key in self.frames:
+            self.nbytes -= buffer_size(self.frames.pop(key)[1])
+
+        self.frames[key] = (payload, renderer)
+        self.nbytes += buffer_size(renderer)
+
+        while self.nbytes > self.budget and len(self.frames) > 1:
+            _, (_, evicted) = self.frames.popitem(last=False)
+            self.nbytes -= buffer_size(evicted)
+
+        return
+
+    def clear(self):
+        self.frames.clear()
+        self.nbytes = 0
+
+        return
+
+
+def buffer_size(renderer) -> int:
+    """Bytes of the RGBA buffer of a RendererAgg."""
+
+    return renderer.width * renderer.height * 4
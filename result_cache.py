@@ -0,0 +1,192 @@
+# result_cache.py
+# Name: Hidetomi Nitta
+# Purpose: Columnar sidecar cache of a result pickle's ResultStore (memory-mapped .npy files), so reopening is instant
+
+import hashlib, json, os, shutil, tempfile, traceback
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from result_store import ResultStore, PackedArray, categorize_keys
+
+# Layout of <name>.pkl.cache/ (the version is bumped whenever it changes, older caches are rebuilt):
+# meta.json                  version, size/mtime/sha1 of the pickle, key categories, n_rows
+# keys.<column>.npy          int32 category codes of Drug, Strain, and Timepoint
+# labels.npy                 row labels (.loc) of the DataFrame
+# fit.<dr|gr>.<field>.npy    ResultStore.fit_params
+# <name>.values.npy/.offsets.npy  PackedArray buffers (volumes, growth_inhibitions, norm_gr, log_volumes)
+cache_version = 1
+packed_names = ['volumes', 'growth_inhibitions', 'norm_gr']
+
+
+def cache_path(file_path) -> Path:
+    """Directory of the cache of a result pickle (next to it)."""
+
+    file_path = Path(file_path)
+
+    return file_path.with_name(file_path.name + '.cache')
+
+def load_store(file_path, write: bool = True) -> ResultStore:
+    """ResultStore of a result pickle, memory-mapped from its cache if the cache is current. Otherwise the pickle is
+    read and (with write) the cache is rebuilt."""
+
+    store = read_cache(file_path)
+
+    if store is None:
+        df = pd.read_pickle(file_path)
+        categorize_keys(df)
+        store = ResultStore(df)
+
+        if write:
+            try:
+                write_cache(file_path, store)
+            except OSError:  # e.g. a read-only directory, the pickle is read again next time
+                traceback.print_exc()
+
+    return store
+
+def read_cache(file_path) -> ResultStore | None:
+    """ResultStore of file_path from its cache. None if there is no cache or it is out of date: the cache is current if
+    the size and mtime of the pickle are unchanged or, if only its mtime changed (e.g. a copy), its sha1 is unchanged."""
+
+    directory = cache_path(file_path)
+
+    try:
+        with open(directory / 'meta.json') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    stat = os.stat(file_path)
+    source = meta.get('source', dict())
+
+    if meta.get('version') != cache_version or source.get('size') != stat.st_size:
+        return None
+
+    if source.get('mtime_ns') != stat.st_mtime_ns:
+        if source.get('sha1') != file_sha1(file_path):
+            return None
+
+        source['mtime_ns'] = stat.st_mtime_ns  # same content, the hash is not computed again next time
+        write_json(directory / 'meta.json', meta)
+
+    try:
+        return open_cache(directory)
+    except (OSError, ValueError, KeyError):  # incomplete cache
+        return None
+
+def update_source(file_path, stat: os.stat_result) -> bool:
+    """Marks the cache of file_path as current after the pickle was rewritten without changing its keys, fits, or
+    arrays (e.g. MS_Flag, see ms_journal.py). Only done if the cache was current for the pickle before (stat)."""
+
+    directory = cache_path(file_path)
+
+    try:
+        with open(directory / 'meta.json') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+
+    if meta.get('source', dict()).get('size') != stat.st_size or meta['source'].get('mtime_ns') != stat.st_mtime_ns:
+        return False
+
+    new_stat = os.stat(file_path)
+    meta['source'] = {'size': new_stat.st_size, 'mtime_ns': new_stat.st_mtime_ns, 'sha1': file_sha1(file_path)}
+    write_json(directory / 'meta.json', meta)
+
+    return True
+
+def open_cache(directory) -> ResultStore:
+    """ResultStore from the cache in directory, without checking it against its pickle (e.g. in export workers). Its
+    arrays are read-only memory maps and its df only holds the key columns (as categoricals) indexed by row label."""
+
+    directory = Path(directory)
+
+    with open(directory / 'meta.json') as f:
+        meta = json.load(f)
+
+    load = lambda name: np.load(directory / f'{name}.npy', mmap_mode='r')
+
+    columns = {column: pd.Categorical.from_codes(load(f'keys.{column}'), categories=meta['categories'][column])
+               for column in ResultStore.key_columns}
+    df = pd.DataFrame(columns, index=pd.Index(load('labels')))
+
+    fit_params = {kind: {field: load(f'fit.{kind}.{field}') for field in ResultStore.fit_fields}
+                  for kind in ['dr', 'gr']}
+    packed = {name: PackedArray(load(f'{name}.values'), load(f'{name}.offsets'))
+              for name in packed_names + ['log_volumes']}
+
+    store = ResultStore.from_arrays(df, fit_params, **packed)
+    store.cache_path = directory
+
+    return store
+
+def write_cache(file_path, store: ResultStore) -> bool:
+    """Writes the cache of file_path from the ResultStore built from it. The new cache replaces the old one as a whole
+    (export workers that still map the old files keep reading them). Returns False if the row labels cannot be stored
+    without pickling (e.g. tuples), in which case the pickle is always read."""
+
+    labels = store.label_index.to_numpy()
+
+    if labels.dtype == object:
+        return False
+
+    # Unique names, so that concurrent writes (e.g. a superseded load of the same file) and leftovers of a crash
+    # never collide
+    directory = cache_path(file_path)
+    temp_directory = Path(tempfile.mkdtemp(prefix=f'{directory.name}.tmp-', dir=directory.parent))
+    os.chmod(temp_directory, 0o755)  # mkdtemp is private to the user
+
+    stat = os.stat(file_path)
+    meta = {'version': cache_version, 'n_rows': len(labels), 'categories': dict(),
+            'source': {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': file_sha1(file_path)}}
+    save = lambda name, array: np.save(temp_directory / f'{name}.npy', np.ascontiguousarray(array))
+
+    for column in ResultStore.key_columns:
+        save(f'keys.{column}', store.codes[column].astype(np.int32))
+        meta['categories'][column] = store.categories[column].tolist()
+
+    save('labels', labels)
+
+    for kind, fields in store.fit_params.items():
+        for field, values in fields.items():
+            save(f'fit.{kind}.{field}', values)
+
+    for name in packed_names + ['log_volumes']:
+        packed = getattr(store, name)
+        save(f'{name}.values', packed.values)
+        save(f'{name}.offsets', packed.offsets)
+
+    write_json(temp_directory / 'meta.json', meta)
+
+    old_directory = None
+
+    if directory.exists():
+        old_directory = Path(tempfile.mkdtemp(prefix=f'{directory.name}.old-', dir=directory.parent))
+        os.replace(directory, old_directory)  # replaces the empty directory that was just created
+
+    try:
+        os.replace(temp_directory, directory)
+    except OSError:  # another write put its cache in place in between
+        shutil.rmtree(temp_directory, ignore_errors=True)
+        raise
+
+    if old_directory is not None:
+        shutil.rmtree(old_directory, ignore_errors=True)
+
+    return True
+
+def write_json(path: Path, obj):
+    """Writes obj as json atomically."""
+
+    temp_path = path.with_name(path.name + '.tmp')
+
+    with open(temp_path, 'w') as f:
+        json.dump(obj, f)
+
+    os.replace(temp_path, path)
+
+    return
+
+def file_sha1(file_path) -> str:
+    with open(file_path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha1').hexdigest()
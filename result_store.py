@@ -0,0 +1,303 @@
+# result_store.py
+# Name: Hidetomi Nitta
+# Purpose: Load-time lookup structures for the MK DiaMOND pipeline DataFrame (used by PlotGUI and helper.py)
+
+import itertools
+from collections import defaultdict
+import numpy as np
+import pandas as pd
+
+
+class ResultStore:
+    """Built once right after a result pickle is read. Maps every (drug, strain, timepoint) key to the integer row
+    positions of its replicates so that selections and plots no longer rebuild boolean masks over the full DataFrame.
+    Also flattens the nested per-row curve fit dicts into contiguous float64 arrays aligned with the row order, and
+    packs the ragged per-row dose/response arrays into PackedArray buffers.
+
+    Positions are always returned in DataFrame order (the order replicates were plotted in with boolean masks).
+
+    The key columns are meant to be categoricals (see categorize_keys()): selections are then matched on their integer
+    codes (self.codes) rather than by comparing strings. self.drug_index (see DrugIndex) is built over the drug
+    categories, so its positions are drug codes.
+
+    A ResultStore can also be opened from the sidecar cache of its pickle (see result_cache.py), in which case
+    self.cache_path is its directory and self.df only holds the key columns."""
+
+    key_columns = ['Drug', 'Strain', 'Timepoint']
+    fit_fields = ['Einf', 'EC50', 'Hill Slope', 'R_squared']
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self.cache_path = None
+        self.build_index()
+        self.build_fit_params()
+        self.build_packed_arrays()
+
+    @classmethod
+    def from_arrays(cls, df: pd.DataFrame, fit_params: dict, volumes, growth_inhibitions, norm_gr, log_volumes):
+        """ResultStore from fit parameters and PackedArray buffers that were built before (e.g. memory-mapped from a
+        cache). df needs the key columns, indexed by row label, in the row order of the arrays."""
+
+        store = cls.__new__(cls)
+        store.df = df
+        store.cache_path = None
+        store.build_index()
+        store.fit_params = fit_params
+        store.volumes, store.growth_inhibitions, store.norm_gr = volumes, growth_inhibitions, norm_gr
+        store.log_volumes = log_volumes
+
+        return store
+
+    def build_index(self):
+        """(drug, strain, timepoint) -> np.ndarray of row positions (grouped by category codes, see
+        categorical_index()), and row label -> row position. Key columns that are not categoricals yet are coded here
+        without converting df."""
+
+        categoricals = {column: pd.Categorical(self.df[column]) for column in self.key_columns}
+        self.codes = {column: categorical.codes for column, categorical in categoricals.items()}
+        self.categories = {column: categorical.categories for column, categorical in categoricals.items()}
+        self.index = categorical_index(list(self.codes.values()), list(self.categories.values()))
+        self.drug_index = DrugIndex(self.categories['Drug'])
+
+        self.label_index = pd.Index(self.df.index)
+        self.keys = {column: self.df[column].to_numpy() for column in self.key_columns}
+
+        return
+
+    def build_fit_params(self):
+        """Flattens row[algo][field] (dose response, algo from 'Best Algo') and row['gr'][field] (growth rate) into
+        self.fit_params['dr'|'gr'][field] float64 arrays. NaN where a row has no fit.
+
+        Format of self.fit_params:
+        {'dr': {'Einf': np.ndarray, 'EC50': ..., 'Hill Slope': ..., 'R_squared': ...}, 'gr': {...}}
+        """
+
+        n_rows = len(self.df)
+        self.fit_params = {kind: {field: np.full(n_rows, np.nan) for field in self.fit_fields} for kind in ['dr', 'gr']}
+
+        # Dose response: one column lookup per algorithm rather than per row
+        if 'Best Algo' in self.df.columns:
+            algos = self.df['Best Algo'].to_numpy()
+
+            for algo in pd.unique(algos):
+                if not algo or algo not in self.df.columns:  # Algo is None (no curve fit for rep)
+                    continue
+
+                algo_positions = np.flatnonzero(algos == algo)
+                fits = self.df[algo].to_numpy()[algo_positions]
+
+                for field in self.fit_fields:
+                    self.fit_params['dr'][field][algo_positions] = [fit_value(fit, field) for fit in fits]
+
+        # Growth rate: a fit only exists when GRinf does
+        if 'gr' in self.df.columns:
+            fits = self.df['gr'].to_numpy()
+
+            for field in self.fit_fields:
+                self.fit_params['gr'][field][:] = [fit_value(fit, field) for fit in fits]
+
+            no_fit = np.isnan(self.fit_params['gr']['Einf'])
+            for field in self.fit_fields:
+                self.fit_params['gr'][field][no_fit] = np.nan
+
+        return
+
+    def build_packed_arrays(self):
+        """Packs 'Volume', 'Growth Inhibitions', and gr['norm_gr'] of every row into PackedArray buffers. log10 of the
+        volumes is computed once here (self.log_volumes shares its offsets with self.volumes)."""
+
+        n_rows = len(self.df)
+        empty = [None] * n_rows
+        volumes = self.df['Volume'].to_numpy() if 'Volume' in self.df.columns else empty
+        growth_inhibitions = self.df['Growth Inhibitions'].to_numpy() if 'Growth Inhibitions' in self.df.columns else empty
+        norm_gr = [nested_get(fit, 'norm_gr') for fit in self.df['gr'].to_numpy()] if 'gr' in self.df.columns else empty
+
+        self.volumes = PackedArray.from_objects(volumes)
+        self.growth_inhibitions = PackedArray.from_objects(growth_inhibitions)
+        self.norm_gr = PackedArray.from_objects(norm_gr)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.log_volumes = PackedArray(np.log10(self.volumes.values), self.volumes.offsets)
+
+        return
+
+    def fits(self, kind: str, positions) -> dict:
+        """Fit parameters ('dr' or 'gr') of the given row positions as {field: np.ndarray}."""
+
+        return {field: values[positions] for field, values in self.fit_params[kind].items()}
+
+    def positions(self, drugs, strains, timepoints) -> np.ndarray:
+        """Row positions of all replicates matching any of the drugs, strains, and timepoints. Looked up in self.index,
+        which is fastest for a few keys (e.g. one subplot), see self.select() for selections."""
+
+        hits = [self.index[key] for key in itertools.product(drugs, strains, timepoints) if key in self.index]
+
+        if not hits:
+            return np.empty(0, dtype=np.intp)
+
+        return np.sort(np.concatenate(hits))
+
+    def positions_of(self, labels) -> np.ndarray:
+        """Row positions of the given row labels (.loc labels)."""
+
+        return self.label_index.get_indexer(list(labels))
+
+    def labels(self, positions) -> list:
+        """Row labels (.loc labels) of the given row positions as python objects."""
+
+        return self.label_index[positions].tolist()
+
+    def key_codes(self, column: str, values) -> np.ndarray:
+        """Category codes of values in a key column (values that do not occur are left out)."""
+
+        codes = self.categories[column].get_indexer(list(values))
+
+        return codes[codes >= 0]
+
+    def select(self, drugs, strains, timepoints) -> np.ndarray:
+        """Same as self.positions(), for selections (e.g. every checked drug). Each key column is matched on its
+        integer codes with one vectorized np.isin, so the cost does not grow with the number of key combinations."""
+
+        mask = np.ones(len(self.df), dtype=bool)
+
+        for column, values in zip(self.key_columns, (drugs, strains, timepoints)):
+            mask &= np.isin(self.codes[column], self.key_codes(column, values))
+
+        return np.flatnonzero(mask)
+
+    def containing(self, drugs) -> np.ndarray:
+        """Row positions of the given single drugs and of every combination that contains any of them."""
+
+        return np.flatnonzero(np.isin(self.codes['Drug'], self.drug_index.containing(drugs)))
+
+    def rows(self, drugs, strains, timepoints) -> pd.DataFrame:
+        """Subset of the DataFrame matching any of the drugs, strains, and timepoints."""
+
+        return self.df.take(self.select(drugs, strains, timepoints))
+
+
+class DrugIndex:
+    """Drug names parsed once into their components (combinations are joined with '+', e.g. 'BDQ+INH'), with an
+    inverted index from every single drug to the positions of the names that contain it (itself and its combinations).
+    Components are matched exactly, so e.g. 'INH' never matches 'INH2'.
+
+    Names keep their order, so self.singles and self.combos are in the order of names."""
+
+    def __init__(self, names):
+        self.names = [str(name) for name in names]
+        self.components = [tuple(part.strip() for part in name.split('+')) for name in self.names]
+        self.is_combo = np.array([len(components) > 1 for components in self.components], dtype=bool)
+        self.positions = {name: position for position, name in enumerate(self.names)}
+
+        postings = defaultdict(list)
+        for position, components in enumerate(self.components):
+            for component in dict.fromkeys(components):
+                postings[component].append(position)
+
+        self.postings = {drug: np.array(positions, dtype=np.intp) for drug, positions in postings.items()}
+
+    @property
+    def singles(self) -> list:
+        return [name for name, is_combo in zip(self.names, self.is_combo) if not is_combo]
+
+    @property
+    def combos(self) -> list:
+        return [name for name, is_combo in zip(self.names, self.is_combo) if is_combo]
+
+    def any_combo(self, drugs) -> bool:
+        """Whether any of the drugs (names in the index) is a combination."""
+
+        return any(self.is_combo[self.positions[drug]] for drug in drugs)
+
+    def containing(self, drugs) -> np.ndarray:
+        """Ascending positions of the names that contain any of the given single drugs."""
+
+        hits = [self.postings[drug] for drug in drugs if drug in self.postings]
+
+        if not hits:
+            return np.empty(0, dtype=np.intp)
+
+        return np.unique(np.concatenate(hits))
+
+    def combos_containing(self, drugs) -> list:
+        """Every combination that contains any of the given single drugs (e.g. all BDQ combinations), in name order."""
+
+        positions = self.containing(drugs)
+
+        return [self.names[position] for position in positions[self.is_combo[positions]]]
+
+
+class PackedArray:
+    """Ragged per-row arrays packed CSR-style into one contiguous float64 values array plus an offsets array. Row i is
+    values[offsets[i]:offsets[i + 1]], which is returned as a zero-copy view."""
+
+    def __init__(self, values: np.ndarray, offsets: np.ndarray):
+        self.values = values
+        self.offsets = offsets
+
+    @classmethod
+    def from_objects(cls, objects):
+        """Packs one array-like (or None/NaN for an empty row) per row."""
+
+        arrays = [np.asarray(obj, dtype=float).ravel() if np.ndim(obj) else np.empty(0) for obj in objects]
+        offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+        np.cumsum([a.size for a in arrays], out=offsets[1:])
+        values = np.concatenate(arrays) if arrays else np.empty(0)
+
+        return cls(values, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position: int) -> np.ndarray:
+        return self.values[self.offsets[position]:self.offsets[position + 1]]
+
+
+def categorize_keys(df: pd.DataFrame) -> dict:
+    """Converts the key columns of df to categoricals in place (right after a result pickle is read). Categories are
+    sorted, so sorting by the key columns keeps the lexical order of strings. Returns the original dtypes for
+    restore_keys()."""
+
+    dtypes = {column: df[column].dtype for column in ResultStore.key_columns}
+
+    for column in ResultStore.key_columns:
+        df[column] = df[column].astype('category')
+
+    return dtypes
+
+def restore_keys(df: pd.DataFrame, dtypes: dict) -> pd.DataFrame:
+    """Copy of df with the dtypes its key columns had before categorize_keys(), e.g. to write it back to its pickle."""
+
+    return df.astype({column: dtype for column, dtype in dtypes.items() if column in df.columns})
+
+def categorical_index(codes: list, categories: list) -> dict:
+    """Same as DataFrame.groupby(...).indices for categorical columns, from their codes: key tuple -> ascending row
+    positions. Rows with a missing key (code -1) are left out, like groupby does."""
+
+    shape = [len(c) for c in categories]
+    valid = np.flatnonzero(np.all([c >= 0 for c in codes], axis=0))
+    combined = np.ravel_multi_index([c[valid] for c in codes], shape)
+
+    order = np.argsort(combined, kind='stable')  # positions stay ascending within each group
+    group_codes, starts = np.unique(combined[order], return_index=True)
+    groups = np.split(valid[order], starts[1:])
+    key_codes = np.unravel_index(group_codes, shape)
+    keys = zip(*[categories[i].take(key_codes[i]).tolist() for i in range(len(categories))])
+
+    return dict(zip(keys, groups))
+
+def nested_get(obj, key):
+    """obj[key] for a nested dict stored in a DataFrame cell. None if obj or key does not exist."""
+
+    try:
+        return obj[key]
+    except (TypeError, KeyError, IndexError):
+        return None
+
+
+def fit_value(fit, field: str) -> float:
+    """Value of field in a nested curve fit dict as a float. NaN if the fit or the field does not exist."""
+
+    value = nested_get(fit, field)
+
+    return np.nan if value is None else float(value)
@@ -0,0 +1,87 @@
+# selection_history.py
+# Name: Hidetomi Nitta
+# Purpose: Undo/redo history of manual selections (replicates selected for removal) for one result file
+
+class SelectionHistory:
+    """Replicate selections of every subplot of one result file, independent of display frames (they survive clearing
+    or re-plotting). A subplot is keyed by (title, rep_locs) since its row labels do not change within a file.
+
+    Every change is pushed as a delta (key, old selections, new selections), so setting, undoing, and redoing a choice
+    costs O(1) and display frames are only told which subplot changed (see PlotFrame.refresh_selections)."""
+
+    def __init__(self):
+        self.selections = dict()  # (title, rep_locs) -> tuple of bools per replicate
+        self.undo_stack = list()
+        self.redo_stack = list()
+
+    @staticmethod
+    def key(title: str, rep_locs) -> tuple:
+        return title, tuple(rep_locs)
+
+    def get(self, key):
+        """Selections of a subplot (None if it was never selected on)."""
+
+        return self.selections.get(key)
+
+    def set(self, key, selections: tuple) -> bool:
+        """Records new selections of a subplot (clears the redo stack). Returns False if nothing changed."""
+
+        old = self.selections.get(key)
+
+        if old == selections:
+            return False
+
+        self.apply(key, selections)
+        self.undo_stack.append((key, old, selections))
+        self.redo_stack.clear()
+
+        return True
+
+    def undo(self):
+        """Reverts the last change and returns its key (None if there is nothing to undo)."""
+
+        if not self.undo_stack:
+            return None
+
+        key, old, new = self.undo_stack.pop()
+        self.apply(key, old)
+        self.redo_stack.append((key, old, new))
+
+        return key
+
+    def redo(self):
+        """Re-applies the last undone change and returns its key (None if there is nothing to redo)."""
+
+        if not self.redo_stack:
+            return None
+
+        key, old, new = self.redo_stack.pop()
+        self.apply(key, new)
+        self.undo_stack.append((key, old, new))
+
+        return key
+
+    def apply(self, key, selections):
+        if selections is None:
+            self.selections.pop(key, None)
+        else:
+            self.selections[key] = selections
+
+        return
+
+    def reps_to_remove(self) -> set:
+        """Contains a set of the integer label (using .loc) of selected replicates or string of single in which >1
+        replicate(s) was selected for removal, over every subplot."""
+
+        reps_to_remove = set()
+
+        for (title, rep_locs), selections in self.selections.items():
+            if selections.count(True) >= 2:
+                reps_to_remove.add(title)
+
+            else:
+                for r, s in zip(rep_locs, selections):
+                    if s and r != None:
+                        reps_to_remove.add(r)
+
+        return reps_to_remove